@@ -1,130 +1,257 @@
 #!/usr/bin/python3
 # -*- coding: utf-8 -*-
 
-import sys
-import string
 import time
+starttime = time.time()
+import sys
 import paho.mqtt.client as mqtt
-import json
 import logging
 import os
 import signal
 import datetime
 import getopt
-from queue import Queue
-import hashlib
-import numpy as np
-from math import sin,cos,pi,asin,radians,degrees,atan2
-import requests
-from configparser import ConfigParser
+import asyncio
+import threading
+from queue import Queue, Empty
+import socket
+from paho.mqtt.properties import Properties
+from paho.mqtt.packettypes import PacketTypes
+from w4lgateway.station import Station
+from w4lgateway.persist import HistoryStore
+from w4lgateway.tsstore import TimeSeriesStore
+from w4lgateway.snapshot import SnapshotFile
+from w4lgateway.sensors import decodejson, jsonpath, jsonvalue, parsetime
+from w4lgateway import config
+from w4lgateway.sinks import Pipeline, Deadband, EcowittSink, MqttSink, LoxoneUdpSink
+from w4lgateway.metrics import Metrics, MetricsServer
+from w4lgateway import lbenv
+from w4lgateway import aio
 
 #############################################################################
 # Global vars
 #############################################################################
 
 q=Queue()
+MAXBATCH=1000                                             # Max. messages converted per batch
+RELOAD=(0, None)                                          # Queue entry: reload the config (SIGHUP)
 verbose=0
-sensorvalues = dict()
+asyncmode=0
 sensors = dict()
 pconfig = dict()
 mqttconfig = dict()
-windspeed_avg2m = list()
-windspeed_avg10m = list()
-winddir_avg2m = list()
-winddir_avg10m = list()
-historydata = dict()
-data = dict()
-lastsend=0
-
-lbpconfigdir = os.popen("perl -e 'use LoxBerry::System; print $lbpconfigdir; exit;'").read()
-lbpdatadir = os.popen("perl -e 'use LoxBerry::System; print $lbpdatadir; exit;'").read()
-lbplogdir = os.popen("perl -e 'use LoxBerry::System; print $lbplogdir; exit;'").read()
-pluginversion = os.popen("perl -e 'use LoxBerry::System; my $version = LoxBerry::System::pluginversion(); print $version; exit;'").read()
+sinkclasses = {'ecowitt': EcowittSink, 'mqtt': MqttSink, 'loxoneudp': LoxoneUdpSink}
+stations = list()                                         # All stations, longest base topic first
+metrics = None
+metricsserver = None
+nextstatus = float('inf')
+configstamp = None                                        # (mtime, size) of the config file when read
+nextconfigcheck = float('inf')
+catchupstart = None                                       # Start of the current catch-up, None: live
+catchupcount = 0
+
+# LoxBerry directories, version and MQTT credentials (Perl only as fallback)
+(lbvalues, lbsource) = lbenv.resolve(os.path.dirname(os.path.abspath(__file__)))
+lbpconfigdir = lbvalues['lbpconfigdir']
+lbpdatadir = lbvalues['lbpdatadir']
+lbplogdir = lbvalues['lbplogdir']
+pluginversion = lbvalues['pluginversion']
 
 #############################################################################
 # MQTT Lib functions
 #############################################################################
 
-def on_connect(client, userdata, flags, rc):
+def on_connect(client, userdata, flags, rc, properties=None):
     if rc==0:
         client.connected_flag=True #set flag
         log.info("MQTT: Connected OK")
+        if flags.get('session present'):
+            log.info("MQTT: Resuming the persistent session, queued messages will be caught up.")
+        # Subscription for W4L Topics (one per station), again after every reconnect
+        for topic in subscriptions():
+            log.info("Subscribe to: %s/#", topic)
+            client.subscribe(topic + "/#", qos=int(pconfig['mqttqos']))
     else:
-        log.critical("MQTT: Bad connection, Returned code=",rc)
+        log.critical("MQTT: Bad connection, Returned code=%s", rc)
 
 def on_message(client, userdata, message):
-    q.put(message)
+    q.put((time.time(), message))
 
 #############################################################################
 # Plugin Lib functions
 #############################################################################
 
+def configfile():
+    return lbpconfigdir + '/weather4lox.cfg'
+
+def filestamp(file):                                      # Changes when the file is rewritten
+    try:
+        st = os.stat(file)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+def newstation(name, topic, stationpconfig, stationsensors):
+    station = Station(name, stationpconfig)
+    # Sensor converters and topic dispatch table
+    station.configure(stationsensors, topic)
+    # Full history / buffer dump in debug mode at most every x seconds (0: never)
+    station.dumpinterval = float(stationpconfig['statedumpinterval'])
+    station.sinks = Pipeline()
+    log.info("Station %s listens on topic %s/#", name, topic)
+    return station
+
 def readconfig():
+    global cfg
+    global pconfig
+    global sensors
+    global stations
+    global configstamp
+    global nextconfigcheck
+    configstamp = filestamp(configfile())
     try:
-        #with open(lbpconfigdir + '/plugin.json') as f:
-        #    global pconfig
-        #    pconfig = json.load(f)
-        # Parse sensors
-        #for item in pconfig['sensors']:
-        #    global sensors
-        #    sensors[item] = pconfig['sensors'][item]
-        cfg = ConfigParser()
-        cfg.read(lbpconfigdir + '/weather4lox.cfg'))
-    except:
-        log.critical("Cannot read plugin configuration")
+        (cfg, pconfig, sensors) = config.readconfig(configfile())
+        stationconfig = config.readstations(cfg, pconfig, sensors)
+    except Exception as e:
+        log.critical("Cannot read plugin configuration: %s", e)
         sys.exit()
-
-def readhistory():
-    global historydata
-    file = lbpdatadir + '/history.json'
+    for (name, topic, stationpconfig, stationsensors) in stationconfig:
+        stations.append(newstation(name, topic, stationpconfig, stationsensors))
+    # A message belongs to the station with the longest matching base topic
+    stations.sort(key=lambda station: len(station.topic), reverse=True)
+    watchconfig(time.time())
+
+def reloadconfig():
+    """Apply a changed config between two messages. Returns the replaced Pipelines.
+
+    Everything is parsed and built first, so a broken config changes
+    nothing. Stations, converters and sinks are only replaced where their
+    config changed; rolling windows and history of the rest are kept.
+    """
+    global cfg
+    global pconfig
+    global sensors
+    global stations
+    global configstamp
+    global nextconfigcheck
+    log.info("Reloading plugin configuration.")
+    configstamp = filestamp(configfile())
+    current = dict((station.name, station) for station in stations)
     try:
-        with open(file) as f:
-            global historydata
-            historydata = json.load(f)
-    except:
-        log.info("Cannot read history data. Use default (empty) dataset")
-    # Set defaults
-    historydata.setdefault('rain', {}).setdefault('event', {}).setdefault('amount',0)
-    historydata.setdefault('rain', {}).setdefault('event', {}).setdefault('last',0)
-    historydata.setdefault('rain', {}).setdefault('hourly', {}).setdefault('amount',0)
-    historydata.setdefault('rain', {}).setdefault('hourly', {}).setdefault('last',0)
-    historydata.setdefault('rain', {}).setdefault('daily', {}).setdefault('amount',0)
-    historydata.setdefault('rain', {}).setdefault('daily', {}).setdefault('last',0)
-    historydata.setdefault('rain', {}).setdefault('weekly', {}).setdefault('amount',0)
-    historydata.setdefault('rain', {}).setdefault('weekly', {}).setdefault('last',0)
-    historydata.setdefault('rain', {}).setdefault('monthly', {}).setdefault('amount',0)
-    historydata.setdefault('rain', {}).setdefault('monthly', {}).setdefault('last',0)
-    historydata.setdefault('rain', {}).setdefault('yearly', {})
-    historydata.setdefault('rain', {}).setdefault('24h', {})
-    historydata.setdefault('rain', {}).setdefault('1h', {})
-    historydata.setdefault('lightning', {}).setdefault('offset',0)
-    historydata.setdefault('lightning', {}).setdefault('event', {}).setdefault('amount',0)
-    historydata.setdefault('lightning', {}).setdefault('event', {}).setdefault('last',0)
-    historydata.setdefault('lightning', {}).setdefault('hourly', {}).setdefault('amount',0)
-    historydata.setdefault('lightning', {}).setdefault('hourly', {}).setdefault('last',0)
-    historydata.setdefault('lightning', {}).setdefault('daily', {}).setdefault('amount',0)
-    historydata.setdefault('lightning', {}).setdefault('daily', {}).setdefault('last',0)
-    historydata.setdefault('lightning', {}).setdefault('weekly', {}).setdefault('amount',0)
-    historydata.setdefault('lightning', {}).setdefault('weekly', {}).setdefault('last',0)
-    historydata.setdefault('lightning', {}).setdefault('monthly', {}).setdefault('amount',0)
-    historydata.setdefault('lightning', {}).setdefault('monthly', {}).setdefault('last',0)
-    historydata.setdefault('lightning', {}).setdefault('yearly', {})
-    historydata.setdefault('lightning', {}).setdefault('24h', {})
-    historydata.setdefault('lightning', {}).setdefault('1h', {})
+        (newcfg, newpconfig, newsensors) = config.readconfig(configfile())
+        stationconfig = config.readstations(newcfg, newpconfig, newsensors)
+        built = dict()
+        for (name, topic, stationpconfig, stationsensors) in stationconfig:
+            if name in current:
+                built[name] = current[name].build(stationsensors, topic)
+            else:
+                built[name] = newstation(name, topic, stationpconfig, stationsensors)
+    except Exception as e:
+        log.error("Cannot reload plugin configuration, keeping the current one: %s", e)
+        return []
+    for key in ('asyncio', 'mqttqos', 'mqttclientid', 'mqttsessionexpiry', 'metricsport', 'metricshost', 'metricstopic'):
+        if str(newpconfig.get(key)) != str(pconfig.get(key)):
+            log.warning("Changed setting %s needs a restart of the gateway.", key.upper())
+    topics = subscriptions()
+    (cfg, pconfig, sensors) = (newcfg, newpconfig, newsensors)
+    watchconfig(time.time())
+    replaced = list()
+    newsinks = list()
+    newstations = list()
+    for (name, topic, stationpconfig, stationsensors) in stationconfig:
+        station = current.pop(name, None)
+        if station is None: # New station
+            station = built[name]
+            readhistory([station])
+            station.metrics = metrics
+            newsinks.append(station)
+        else:
+            sinkschanged = station.config != stationpconfig or deadbands(station.sensors) != deadbands(stationsensors)
+            if topic != station.topic:
+                log.info("Station %s listens on topic %s/#", name, topic)
+            changed = station.reconfigure(stationsensors, topic, built[name])
+            if changed:
+                log.info("Station %s: Changed sensors: %s", name, ", ".join(sorted(changed)))
+            for key in ('historyinterval', 'historyjournal', 'historyyears', 'snapshot', 'snapshotfile', 'snapshotslots', 'timeseries', 'timeseriesinterval', 'timeseriesresolution', 'timeseriesdays', 'hourlyhistoryhours'):
+                if str(stationpconfig[key]) != str(station.config[key]):
+                    log.warning("Station %s: Changed setting %s needs a restart of the gateway.", name, key.upper())
+            station.config = stationpconfig
+            station.dumpinterval = float(stationpconfig['statedumpinterval'])
+            if sinkschanged:
+                replaced.append(station.sinks)
+                station.sinks = Pipeline()
+                newsinks.append(station)
+        newstations.append(station)
+    for station in current.values(): # Removed stations
+        log.info("Station %s removed.", station.name)
+        replaced.append(station.sinks)
+        station.close()
+    newstations.sort(key=lambda station: len(station.topic), reverse=True)
+    stations = newstations
+    for station in newsinks:
+        setupsinks(station)
+    # Subscriptions only change if a base topic changed
+    if subscriptions() != topics:
+        for topic in topics:
+            if topic not in subscriptions():
+                log.info("Unsubscribe from: %s/#", topic)
+                client.unsubscribe(topic + "/#")
+        for topic in subscriptions():
+            if topic not in topics:
+                log.info("Subscribe to: %s/#", topic)
+                client.subscribe(topic + "/#", qos=int(pconfig['mqttqos']))
+    log.info("Plugin configuration reloaded.")
+    return replaced
+
+def watchconfig(now):                                     # Next check of the config file (CONFIGWATCH=0: only on SIGHUP)
+    global nextconfigcheck
+    nextconfigcheck = now + float(pconfig['configwatch']) if float(pconfig['configwatch']) > 0 else float('inf')
+
+def configchanged(now):                                   # File watch: config file rewritten since it was read
+    if now < nextconfigcheck:
+        return False
+    watchconfig(now)
+    return filestamp(configfile()) != configstamp
+
+def reload_handler(a="", b=""):                           # SIGHUP: reload between two messages
+    # Not q.put() directly, the interrupted main thread may hold the lock of the queue
+    threading.Thread(target=q.put, args=(RELOAD,)).start()
+
+def readhistory(stations):
+    for station in stations:
+        filename = '/history.json' if station.name == "main" else '/history_' + station.name + '.json'
+        station.loadhistory(HistoryStore(lbpdatadir + filename, station.config['historyinterval'], int(station.config['historyjournal']) > 0))
+        # Observation time series and hourly roll-up in hourlyhistory.dat layout
+        if int(station.config['timeseries']):
+            suffix = "" if station.name == "main" else "_" + station.name
+            station.series = TimeSeriesStore(lbpdatadir + '/timeseries/' + station.name, lbplogdir + '/hourlyhistory' + suffix + '.dat',
+                station.config['timeseriesinterval'], station.config['timeseriesresolution'], station.config['timeseriesdays'], station.config['hourlyhistoryhours'])
+            station.series.mapcolumns(station.sensors, station.name)
+        # Current values for local readers (data/snapshot.format)
+        if int(station.config['snapshot']):
+            (base, ext) = os.path.splitext(station.config['snapshotfile'])
+            file = station.config['snapshotfile'] if station.name == "main" else base + "_" + station.name + ext
+            try:
+                station.snapshot = SnapshotFile(file, station.config['snapshotslots'])
+            except OSError as e:
+                log.error("Cannot create snapshot file %s: %s", file, e)
 
 def exit_handler(a="", b=""):
-    # Close MQTT
-    client.loop_stop()
+    # Send pending data while MQTT is still connected (MQTT sinks publish through the client)
+    for station in stations:
+        station.sinks.publish(time.time(), station.sensorvalues, True)
+        station.sinks.stop()
+    # Close MQTT: the loop writes the queued messages before the DISCONNECT
     log.info("MQTT: Disconnecting from Broker.")
     client.disconnect()
+    client.loop_stop()
+    if metricsserver is not None:
+        metricsserver.stop()
     # Write history data
-    try:
-        # Serializing json
-        json_object = json.dumps(historydata, indent=4)
-        with open(lbpdatadir + '/history.json', 'w') as f:
-            f.write(json_object)
-    except:
-        log.critical("Cannot save history data")
+    for station in stations:
+        station.close()
+    goodbye()
+
+def goodbye():
     # close the log
     if str(logdbkey) != "":
         logging.shutdown()
@@ -134,114 +261,320 @@ def exit_handler(a="", b=""):
     # End
     sys.exit();
 
-def ctof(c,n):                                           # convert Celsius to Fahrenheit
-  out = "-9999"
+def stationfor(topic):                                    # Station a topic belongs to
+  for station in stations:
+      if topic.startswith(station.topic + "/") or topic == station.topic:
+          return station
+  return None
+
+def subscriptions():                                      # Base topics, without overlapping ones
+  topics = list()
+  for topic in sorted(station.topic for station in stations):
+      if not any(topic == t or topic.startswith(t + "/") for t in topics):
+          topics.append(topic)
+  return topics
+
+def processmessage(ts, message, document=None):           # Convert a received measurement
+  station = stationfor(message.topic)
+  if station is not None:
+      station.process(message.topic, message.payload, ts, document)
+
+def messagetime(received, message):                       # Source time of a message (SOURCETIME)
+  """Returns (ts, decoded JSON payload or None)."""
+  document = None
   try:
-    out = round((float(c)*9/5.0) + 32,n)
-  except ValueError: pass
-  return out
-
-def hpatoin(f,n):                                        # convert HPa to inHg 
-  return round(float(f)/33.87,n)
-
-def mstomph(m,n):                                        # convert ms to mph
-  return round(float(m)*2.23694,n)
-
-def intomm(f,n):                                         # convert in to mm
-  return round(float(f)/0.0393701,n)
-
-def mmtoin(f,n):                                         # convert mm to in
-  return round(float(f)/25.4,n)
-
-def avgwind(d):                                          # get avg from list
-  s = sinSum = cosSum = 0;
-  # https://www.dwd.de/DE/leistungen/lf_11_flugwetterbetriebsdienste/handbuch_band_tech_v4.0.pdf
-  l = len(d)
-  if len(d) < 1:
-      return -9999
-  for i in range(l):
-      sinSum += sin(radians(d[i]));
-      cosSum += cos(radians(d[i]));
-  a = round((degrees(atan2(sinSum, cosSum)) + 360) % 360,1)
-  return a
-
-def rainstats(x, rainrate, amount):                       # Create rain stats
-  global historydata
-  ret = dict()
-  thishour = str( x.strptime(x.strftime("%Y/%m/%d %H:00:00"), "%Y/%m/%d %H:%M:%S").timestamp() )
-  thisminute = str( x.strptime(x.strftime("%Y/%m/%d %H:%M:00"), "%Y/%m/%d %H:%M:%S").timestamp() )
-  if float(rainrate) >= 0.03937: # Calculate Rain Event, https://www.wetterstationsforum.info/viewtopic.php?t=241
-      historydata['rain']['event']['amount'] = round(float(historydata['rain']['event']['amount']) + amount,3)
-      historydata['rain']['event']['last'] = str(x.timestamp())
-  historydata['rain']['hourly']['amount'] = round(float(historydata['rain']['hourly']['amount']) + amount,3)
-  historydata['rain']['daily']['amount'] = round(float(historydata['rain']['daily']['amount']) + amount,3)
-  historydata['rain']['weekly']['amount'] = round(float(historydata['rain']['weekly']['amount']) + amount,3)
-  historydata['rain']['monthly']['amount'] = round(float(historydata['rain']['monthly']['amount']) + amount,3)
-  historydata.setdefault('rain', {}).setdefault('yearly', {}).setdefault(x.strftime("%Y"),0)
-  historydata['rain']['yearly'][x.strftime("%Y")] = round(float(historydata['rain']['yearly'][x.strftime("%Y")]) + amount,3)
-  historydata['rain']['hourly']['last'] = str(x.timestamp())
-  historydata['rain']['daily']['last'] = str(x.timestamp())
-  historydata['rain']['weekly']['last'] = str(x.timestamp())
-  historydata['rain']['monthly']['last'] = str(x.timestamp())
-  ret['1'] = rainrate
-  ret['2'] = round(float(historydata['rain']['event']['amount']),3)
-  ret['3'] = 0
-  for minute in historydata['rain']['1h']:
-      ret['3'] = round(ret['3'] + float(historydata['rain']['1h'][minute]),3)
-  ret['4'] = round(float(historydata['rain']['daily']['amount']),3)
-  ret['5'] = round(float(historydata['rain']['weekly']['amount']),3)
-  ret['6'] = round(float(historydata['rain']['monthly']['amount']),3)
-  ret['7'] = round(float(historydata['rain']['yearly'][x.strftime("%Y")]),3)
-  ret['8'] = 0
-  for year in historydata['rain']['yearly']:
-      ret['8'] = round(ret['8'] + float(historydata['rain']['yearly'][year]),3)
-  historydata.setdefault('rain', {}).setdefault('24h', {}).setdefault(thishour,0)
-  historydata['rain']['24h'][thishour] = historydata['rain']['hourly']['amount']
-  ret['9'] = 0
-  for hour in historydata['rain']['24h']:
-      ret['9'] = round(ret['9'] + float(historydata['rain']['24h'][hour]),3)
-  historydata.setdefault('rain', {}).setdefault('1h', {}).setdefault(thisminute,0)
-  historydata['rain']['1h'][thisminute] = amount
-  return (ret)
-
-def lightningstats(x, number, amount):                    # Create lightning stats
-  global historydata
-  ret = dict()
-  thishour = str( x.strptime(x.strftime("%Y/%m/%d %H:00:00"), "%Y/%m/%d %H:%M:%S").timestamp() )
-  thisminute = str( x.strptime(x.strftime("%Y/%m/%d %H:%M:00"), "%Y/%m/%d %H:%M:%S").timestamp() )
-  historydata['lightning']['offset'] = number
-  historydata['lightning']['hourly']['amount'] = int(historydata['lightning']['hourly']['amount']) + amount
-  historydata['lightning']['daily']['amount'] = int(historydata['lightning']['daily']['amount']) + amount
-  historydata['lightning']['weekly']['amount'] = int(historydata['lightning']['weekly']['amount']) + amount
-  historydata['lightning']['monthly']['amount'] = int(historydata['lightning']['monthly']['amount']) + amount
-  historydata.setdefault('lightning', {}).setdefault('yearly', {}).setdefault(x.strftime("%Y"),0)
-  historydata['lightning']['yearly'][x.strftime("%Y")] = int(historydata['lightning']['yearly'][x.strftime("%Y")]) + amount
-  historydata['lightning']['hourly']['last'] = str(x.timestamp())
-  historydata['lightning']['daily']['last'] = str(x.timestamp())
-  historydata['lightning']['weekly']['last'] = str(x.timestamp())
-  historydata['lightning']['monthly']['last'] = str(x.timestamp())
-  ret['1'] = int(historydata['lightning']['daily']['amount'])
-  ret['2'] = int(historydata['lightning']['event']['amount'])
-  ret['3'] = 0
-  for minute in historydata['lightning']['1h']:
-      ret['3'] = int(round(ret['3'] + float(historydata['lightning']['1h'][minute]),1))
-  ret['4'] = int(historydata['lightning']['daily']['amount'])
-  ret['5'] = int(historydata['lightning']['weekly']['amount'])
-  ret['6'] = int(historydata['lightning']['monthly']['amount'])
-  ret['7'] = int(historydata['lightning']['yearly'][x.strftime("%Y")])
-  ret['8'] = 0
-  for year in historydata['lightning']['yearly']:
-      ret['8'] = int(ret['8'] + int(historydata['lightning']['yearly'][year]))
-  thishour = str( x.strptime(x.strftime("%Y/%m/%d %H:00:00"), "%Y/%m/%d %H:%M:%S").timestamp() )
-  thisminute = str( x.strptime(x.strftime("%Y/%m/%d %H:%M:00"), "%Y/%m/%d %H:%M:%S").timestamp() )
-  historydata.setdefault('lightning', {}).setdefault('24h', {}).setdefault(thishour,0)
-  historydata['lightning']['24h'][thishour] = historydata['lightning']['hourly']['amount']
-  ret['9'] = 0
-  for hour in historydata['lightning']['24h']:
-      ret['9'] = int(round(ret['9'] + float(historydata['lightning']['24h'][hour]),1))
-  historydata.setdefault('lightning', {}).setdefault('1h', {}).setdefault(thisminute,0)
-  historydata['lightning']['1h'][thisminute] = amount
-  return (ret)
+      if pconfig['sourcetime'] == "json": # The document is passed on, sensors do not decode it again
+          document = decodejson(message.payload)
+          value = jsonvalue(document, jsonpath(pconfig['sourcetimejson']))
+      elif pconfig['sourcetime'] == "property": # MQTT v5 user property
+          value = dict(getattr(message.properties, 'UserProperty', []))[pconfig['sourcetimeproperty']]
+      else:
+          return (received, None)
+      ts = parsetime(value)
+  except (KeyError, TypeError, ValueError, OverflowError):
+      if log.isEnabledFor(logging.DEBUG):
+          log.debug("No source time in message of %s, using the receive time.", message.topic)
+      return (received, document)
+  # A source clock running ahead must not move the windows into the future
+  return (min(ts, received), document)
+
+def processmessages(messages):                            # Convert a batch of received measurements
+  """Returns the oldest receive time of the batch."""
+  oldest = min([ts for (ts, message) in messages] or [float('inf')])
+  if pconfig['sourcetime'] != "receive":
+      messages = [messagetime(ts, message) + (message,) for (ts, message) in messages]
+  else:
+      messages = [(ts, None, message) for (ts, message) in messages]
+  if len(messages) == 1 or not int(pconfig['batchingest']):
+      for (ts, document, message) in messages:
+          processmessage(ts, message, document)
+      return oldest
+  # Group by station, the station coalesces / batches per sensor
+  batches = dict()
+  for (ts, document, message) in messages:
+      station = stationfor(message.topic)
+      if station is not None:
+          batches.setdefault(station, []).append((message.topic, message.payload, ts, document))
+  for station in batches:
+      station.processbatch(batches[station])
+  return oldest
+
+def catchingup(count, oldest, now):                       # Backlog after an outage: full batches or messages queued for long
+  # Receive times only: a source clock running behind must not look like a backlog
+  global catchupstart
+  global catchupcount
+  backlog = count >= MAXBATCH or oldest < now - float(pconfig['catchupage'])
+  if backlog:
+      if catchupstart is None:
+          log.info("Catching up a backlog of received messages, sinks wait for the final values.")
+          catchupstart = now
+          catchupcount = 0
+      catchupcount += count
+      if metrics is not None:
+          metrics.inc('w4l_catchup_messages_total', (), count)
+  elif catchupstart is not None:
+      catchupcount += count
+      log.info("Caught up %d messages in %.1f seconds.", catchupcount, now - catchupstart)
+      catchupstart = None
+  return backlog
+
+def housekeeping(now):                                    # Reset / calculate some historical data
+  for station in stations:
+      station.housekeeping(now)
+
+def deadbands(sensors):                                   # Deadband and max. age per output name
+  bands = dict()
+  for item in sensors:
+      for key in sensors[item]:
+          if key.startswith('name') and key[4:].isdigit() and sensors[item][key]:
+              val = key[4:]
+              bands[str(sensors[item][key])] = (sensors[item].get('deadband' + val), sensors[item].get('maxage' + val))
+  return bands
+
+def sinkoptions(station, mode):                           # Common options of the output sinks
+  options = {'retries': station.config['sinkretries']}
+  if mode == "changes":
+      options['deadband'] = Deadband(deadbands(station.sensors), station.config['publishmaxage'])
+  return options
+
+def setupsinks(station):                                  # Create the output sinks of a station
+  pconfig = station.config
+  sinks = station.sinks
+  # Ecowitt server
+  if pconfig.get('ecowittserver'):
+      url = pconfig['ecowittserver'] + ":" + str(pconfig.get('ecowittport', 80)) + '/data/report/'
+      log.info("Station %s: Sending data to Ecowitt server %s", station.name, url)
+      sinks.add(sinkclasses['ecowitt'](url, pconfig['ecowittinterval'], pconfig['ecowittconnecttimeout'], pconfig['ecowittreadtimeout'], **sinkoptions(station, pconfig['ecowittmode'])))
+  # MQTT republish
+  if pconfig.get('mqttpublishtopic'):
+      topic = pconfig['mqttpublishtopic']
+      if stationfor(topic) is not None:
+          log.warning("MQTT publish topic %s is below a subscribed topic. Make sure no sensor topic matches it.", topic)
+      log.info("Station %s: Publishing data to MQTT topic %s", station.name, topic)
+      sinks.add(sinkclasses['mqtt'](client, topic, pconfig['mqttpublishinterval'], **sinkoptions(station, pconfig['mqttpublishmode'])))
+  # Loxone virtual UDP input
+  if pconfig.get('loxoneudpport'):
+      host = pconfig.get('loxonehost') or lbenv.miniserver(pconfig.get('msno') or cfg.get('SERVER','MSNO', fallback=1))
+      if host:
+          log.info("Station %s: Sending data to Loxone UDP input %s:%s", station.name, host, pconfig['loxoneudpport'])
+          sinks.add(sinkclasses['loxoneudp'](host, pconfig['loxoneudpport'], pconfig['loxoneudpinterval'], pconfig.get('loxoneudpprefix', ""), **sinkoptions(station, pconfig['loxoneudpmode'])))
+      else:
+          log.error("Cannot find Miniserver for Loxone UDP input.")
+
+def setupmetrics():                                       # Metrics endpoint and status topic
+  global metrics
+  global metricsserver
+  global nextstatus
+  if not pconfig.get('metricsport') and not pconfig.get('metricstopic'):
+      return
+  metrics = Metrics()
+  metrics.describe('w4l_messages_total', "Converted measurements per sensor")
+  metrics.describe('w4l_handler_seconds', "Conversion time per measurement")
+  metrics.describe('w4l_conversion_errors_total', "Payloads that could not be converted")
+  metrics.describe('w4l_unmatched_messages_total', "Received messages without a configured sensor")
+  metrics.describe('w4l_queue_depth', "Messages waiting in the queue")
+  metrics.describe('w4l_queue_depth_max', "Max. number of messages waiting in the queue")
+  metrics.describe('w4l_sink_latency_seconds', "Duration of successful sends per sink")
+  metrics.describe('w4l_history_entries', "Entries in the history data")
+  metrics.describe('w4l_catchup_messages_total', "Messages converted while catching up a backlog")
+  metrics.gauge(lambda: [('w4l_queue_depth', (), q.qsize())])
+  metrics.gauge(stationsamples)
+  for station in stations:
+      station.metrics = metrics
+  if pconfig.get('metricsport') and not asyncmode: # asyncio mode serves it from the event loop
+      try:
+          metricsserver = MetricsServer(metrics, pconfig['metricsport'], pconfig['metricshost'])
+          metricsserver.start()
+          log.info("Metrics available at http://%s:%s/metrics", pconfig['metricshost'], pconfig['metricsport'])
+      except OSError as e:
+          log.error("Cannot start metrics endpoint: %s", e)
+  if pconfig.get('metricstopic'):
+      log.info("Publishing metrics to MQTT topic %s", pconfig['metricstopic'])
+      nextstatus = time.time()
+
+def stationsamples():                                     # History and sink metrics of the current stations
+  ret = list()
+  for station in stations:
+      ret.extend(station.samples())
+      ret.extend(station.sinks.samples((('station', station.name),)))
+  return ret
+
+def publishstatus(now):                                   # Metrics to the MQTT status topic
+  global nextstatus
+  client.publish(pconfig['metricstopic'], metrics.snapshot(), qos=0, retain=True)
+  nextstatus = now + float(pconfig['metricsinterval'])
+
+def nextdeadline(now):                                    # Next time the main loop has work to do
+  # Next period rollover (hourly/daily/weekly/monthly always change on a full hour)
+  x = datetime.datetime.fromtimestamp(now)
+  due = (x.replace(minute=0, second=0, microsecond=0) + datetime.timedelta(hours=1)).timestamp()
+  for station in stations:
+      due = min(due, station.deadline())
+      # Next send
+      due = min(due, station.sinks.deadline())
+  due = min(due, nextstatus, nextconfigcheck)
+  # Expiry checks are "greater than", so wake up just after the deadline
+  return due + 0.01
+
+def newclient():                                          # MQTT client with LoxBerry credentials
+  # QoS 1 uses a persistent session with a stable client id: the broker
+  # queues messages while the gateway is down or disconnected
+  durable = int(pconfig['mqttqos']) > 0
+  clientid = pconfig.get('mqttclientid') or ("weather4lox-" + socket.gethostname() if durable else "")
+  if pconfig['sourcetime'] == "property": # User properties need MQTT v5
+      client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION1, client_id=clientid, protocol=mqtt.MQTTv5)
+  else:
+      client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION1, client_id=clientid, clean_session=not durable)
+  if durable:
+      log.info("MQTT: Persistent session with client id %s.", clientid)
+  client.connected_flag=False
+  client.on_connect = on_connect
+  if mqttconfig['username'] and mqttconfig['password']:
+      log.info("Using MQTT Username and password.")
+      client.username_pw_set(username = mqttconfig['username'],password = mqttconfig['password'])
+  return client
+
+def connect(client):                                      # Connect to the LoxBerry broker
+  log.info("Connecting to Broker %s on port %s.", mqttconfig['server'], mqttconfig['port'])
+  if pconfig['sourcetime'] == "property":
+      durable = int(pconfig['mqttqos']) > 0
+      properties = Properties(PacketTypes.CONNECT)
+      if durable:
+          properties.SessionExpiryInterval = int(pconfig['mqttsessionexpiry'])
+      client.connect(mqttconfig['server'], port = int(mqttconfig['port']), clean_start = not durable, properties = properties)
+  else:
+      client.connect(mqttconfig['server'], port = int(mqttconfig['port']))
+
+async def amain():                                        # asyncio mode: one event loop, no threads
+  global client
+  global q
+  loop = asyncio.get_running_loop()
+  stop = asyncio.Event()
+  for sig in (signal.SIGTERM, signal.SIGINT):
+      loop.add_signal_handler(sig, stop.set)
+  loop.add_signal_handler(signal.SIGHUP, lambda: q.put_nowait(RELOAD))
+  sinkclasses.update({'ecowitt': aio.AsyncEcowittSink, 'mqtt': aio.AsyncMqttSink, 'loxoneudp': aio.AsyncLoxoneUdpSink})
+
+  # Conncect to broker
+  client = newclient()
+  mqttio = aio.AsyncMqtt(client, loop)
+  q = mqttio.queue
+  client.on_message = mqttio.on_message
+  connect(client)
+  counter=0
+  while not client.connected_flag:
+      log.info("MQTT: Wait for connection...")
+      await asyncio.sleep(1)
+      counter+=1
+      if counter > 60 or stop.is_set():
+          log.critical("MQTT: Cannot connect to Broker %s on port %s.", mqttconfig['server'], mqttconfig['port'])
+          return
+
+  # Output sinks and metrics
+  for station in stations:
+      setupsinks(station)
+  setupmetrics()
+  server = None
+  if metrics is not None and pconfig.get('metricsport'):
+      try:
+          server = await aio.servemetrics(metrics, pconfig['metricshost'], pconfig['metricsport'])
+          log.info("Metrics available at http://%s:%s/metrics", pconfig['metricshost'], pconfig['metricsport'])
+      except OSError as e:
+          log.error("Cannot start metrics endpoint: %s", e)
+  log.info("Startup finished in %.3f seconds (asyncio mode).", time.time() - starttime)
+
+  rearm = asyncio.Event()                               # Deadlines may have changed
+
+  async def consume():                                  # Convert received messages in batches
+      while True:
+          messages = [await q.get()]
+          if metrics is not None:
+              metrics.high('w4l_queue_depth_max', q.qsize() + 1)
+          while len(messages) < MAXBATCH and not q.empty():
+              messages.append(q.get_nowait())
+          count = len(messages)
+          oldest = float('inf')
+          while RELOAD in messages:                     # Reload between two messages
+              i = messages.index(RELOAD)
+              oldest = min(oldest, processmessages(messages[:i]))
+              for pipeline in reloadconfig():
+                  await aio.stoppipeline(pipeline)
+              messages = messages[i + 1:]
+          oldest = min(oldest, processmessages(messages))
+          catchingup(count, oldest, time.time())
+          if q.empty() and catchupstart is not None:    # Backlog is caught up
+              catchingup(0, float('inf'), time.time())
+          mqttio.resume()
+          rearm.set()
+          await asyncio.sleep(0)                        # Let sinks and MQTT I/O run during a backlog
+
+  async def timers():                                   # Period rollovers, checkpoints and sends
+      nextrun = 0
+      while True:
+          now = datetime.datetime.now()
+          if now.timestamp() >= nextrun:
+              if configchanged(now.timestamp()):
+                  for pipeline in reloadconfig():
+                      await aio.stoppipeline(pipeline)
+              housekeeping(now)
+              if catchupstart is None: # After a backlog only its final values are sent
+                  for station in stations:
+                      station.sinks.publish(now.timestamp(), station.sensorvalues)
+              if now.timestamp() >= nextstatus:
+                  publishstatus(now.timestamp())
+          nextrun = nextdeadline(now.timestamp())
+          rearm.clear()
+          try:
+              await asyncio.wait_for(rearm.wait(), max(0, nextrun - time.time()))
+          except asyncio.TimeoutError:
+              pass
+
+  tasks = [loop.create_task(consume()), loop.create_task(timers())]
+  await stop.wait()
+
+  # Clean shutdown: stop receiving, convert what is queued, flush sinks, then
+  # disconnect (MQTT sinks publish through the client) and save the history
+  for task in tasks:
+      task.cancel()
+  await asyncio.gather(*tasks, return_exceptions=True)
+  mqttio.pause()
+  messages = list()
+  while not q.empty():
+      messages.append(q.get_nowait())
+  messages = [entry for entry in messages if entry is not RELOAD]
+  if messages:
+      processmessages(messages)
+  for station in stations:
+      station.sinks.publish(time.time(), station.sensorvalues, True)
+      await aio.stoppipeline(station.sinks)
+  log.info("MQTT: Disconnecting from Broker.")
+  await mqttio.close()
+  if server is not None:
+      server.close()
+      await server.wait_closed()
+  for station in stations:
+      station.close()
+  goodbye()
 
 #############################################################################
 # Main Script
@@ -256,8 +589,8 @@ logdbkey=""
 # https://stackabuse.com/command-line-arguments-in-python/
 full_cmd_arguments = sys.argv
 argument_list = full_cmd_arguments[1:]
-short_options = "vlfd:"
-long_options = ["verbose","loglevel=","logfile=","logdbkey="]
+short_options = "vlfd:a"
+long_options = ["verbose","loglevel=","logfile=","logdbkey=","asyncio"]
 
 try:
     arguments, values = getopt.getopt(argument_list, short_options, long_options)
@@ -275,6 +608,8 @@ for current_argument, current_value in arguments:
         logfile=current_value
     elif current_argument in ("-d", "--logdbkey"):
         logdbkey=current_value
+    elif current_argument in ("-a", "--asyncio"):
+        asyncmode=1
 
 # Logging with standard LoxBerry log format
 numeric_loglevel = getattr(logging, loglevel.upper(), None)
@@ -298,37 +633,33 @@ log.addHandler(fileHandler)
 
 # Logging Starting message
 log.setLevel(logging.INFO)
-log.info("Starting Logfile for w4l-gateway. The Loglevel is %s" % loglevel.upper())
+log.info("Starting Logfile for w4l-gateway. The Loglevel is %s", loglevel.upper())
 log.setLevel(numeric_loglevel)
 
 # Read MQTT config
-mqttconfig['server'] = os.popen("perl -e 'use LoxBerry::IO; my $mqttcred = LoxBerry::IO::mqtt_connectiondetails(); print $mqttcred->{brokerhost}; exit'").read()
-mqttconfig['port'] = os.popen("perl -e 'use LoxBerry::IO; my $mqttcred = LoxBerry::IO::mqtt_connectiondetails(); print $mqttcred->{brokerport}; exit'").read()
-mqttconfig['username'] = os.popen("perl -e 'use LoxBerry::IO; my $mqttcred = LoxBerry::IO::mqtt_connectiondetails(); print $mqttcred->{brokeruser}; exit'").read()
-mqttconfig['password'] = os.popen("perl -e 'use LoxBerry::IO; my $mqttcred = LoxBerry::IO::mqtt_connectiondetails(); print $mqttcred->{brokerpass}; exit'").read()
+log.info("LoxBerry settings read via %s lookup (Plugin version %s)", lbsource, pluginversion)
+mqttconfig['server'] = lbvalues['brokerhost']
+mqttconfig['port'] = lbvalues['brokerport']
+mqttconfig['username'] = lbvalues['brokeruser']
+mqttconfig['password'] = lbvalues['brokerpass']
 
 # Read Plugin config
 readconfig()
 
 # Read history data
-readhistory()
-
-# Conncect to broker
-client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION1)
-client.connected_flag=False
-client.on_connect = on_connect
-
-if mqttconfig['username'] and mqttconfig['password']:
-    log.info("Using MQTT Username and password.")
-    client.username_pw_set(username = mqttconfig['username'],password = mqttconfig['password'])
+readhistory(stations)
 
-log.info("Connecting to Broker %s on port %s." % (mqttconfig['server'], str(mqttconfig['port'])))
-client.connect(mqttconfig['server'], port = int(mqttconfig['port']))
+# asyncio mode (command line or [GATEWAY] ASYNCIO=1)
+if asyncmode or int(pconfig['asyncio']):
+    asyncmode=1
+    asyncio.run(amain())
+    sys.exit()
 
-# Subscription for W4L Topic
-log.info("Subscribe to: " + cfg.get('SERVER','TOPIC') + "/#")
-client.subscribe(cfg.get('SERVER','TOPIC') + "/#", qos=0)
+# Conncect to broker
+client = newclient()
 client.on_message = on_message
+# Subscriptions (one per station) are done in on_connect
+connect(client)
 
 # Start MQTT Loop
 client.loop_start()
@@ -340,239 +671,67 @@ while not client.connected_flag: #wait in loop
     time.sleep(1)
     counter+=1
     if counter > 60:
-        log.critical("MQTT: Cannot connect to Broker %s on port %s." % (mqttconfig['server'], str(mqttconfig['port'])))
+        log.critical("MQTT: Cannot connect to Broker %s on port %s.", mqttconfig['server'], mqttconfig['port'])
         exit()
 
-# Start MQTT Loop
-client.loop_start()
+# Output sinks
+for station in stations:
+    setupsinks(station)
+
+# Metrics
+setupmetrics()
 
 # Exit handler
 signal.signal(signal.SIGTERM, exit_handler)
 signal.signal(signal.SIGINT, exit_handler)
+signal.signal(signal.SIGHUP, reload_handler)
+
+log.info("Startup finished in %.3f seconds.", time.time() - starttime)
 
 # Loop
+# Block on the queue until a message arrives or the next deadline is due
+nextrun = 0
 while True:
 
-    # Check for any subscribed messages in the queue
-    while not q.empty():
-        message = q.get()
-        response = ""
-
-        log.debug("Received subscription: " + str(message.topic) + " Payload: " + str(message.payload.decode("utf-8")))
-
-        if message is None:
-            continue
-
-        # Check for new measurement
-        for item in sensors:
-            if sensors[item]['topic'] in message.topic:
-                data.setdefault(item, {})
-                data[item].clear()
-                log.debug("Received Measurement " + item + " (Original): " + str(message.topic) + " " + str(message.payload.decode("utf-8")))
-                # Temperature
-                if item == "temp":
-                    data[item]['1'] = ctof(float(message.payload),1)
-                # Humidity
-                elif item == "humidity":
-                    data[item]['1'] = round(float(message.payload),1)
-                # Pressure
-                elif item == "pressure":
-                    data[item]['1'] = hpatoin(float(message.payload),3)
-                    # Calculate relative pressure: https://www.bjoerns-techblog.de/2017/12/luftdruck-absolut-oder-relativ/
-                    # https://www.wetterstationsforum.info/viewtopic.php?t=171#p1443
-                    correction = 0
-                    if 'height' in sensors[item]:
-                        if float(sensors[item]['height']) > 0 and sensors[item]['height'] is not None:
-                            if float(sensors[item]['height']) > 880:
-                                correction = float(sensors[item]['height']) / 11
-                            else:
-                               correction = float(sensors[item]['height']) / 8
-                    data[item]['2'] = hpatoin(float(message.payload) + correction,3)
-                # Illuminance
-                elif item == "illuminance":
-                    data[item]['1'] = round(float(message.payload),1)
-                    if int(sensors[item]['calc_sr']) > 0: # Calc SolarRadiation from Lux. 126.7 is the facotor Ecowitt uses
-                        data[item]['2'] = round(float(data['1'])/126.7,2)    # https://www.extrica.com/article/21667/pdf
-                # Twilight
-                elif item == "twilight":
-                    data[item]['1'] = -9999
-                    if 'max' in sensors[item]:
-                        if float(sensors[item]['max']) > 0 and sensors[item]['max'] is not None:
-                            data[item]['1'] = round( float(message.payload) / float(sensors[item]['max']) * 100,1)
-                # UV Index
-                elif item == "uv":
-                    data[item]['1'] = round(float(message.payload) / 0.1,1)
-                # Windspeed
-                elif item == "windspeed":
-                    wind = mstomph(float(message.payload),2)
-                    while len(windspeed_avg2m) > 39: # Interval 3 sec, 40 values
-                        del windspeed_avg2m[0]
-                    while len(windspeed_avg10m) > 199: # Interval 3 sec, 200 values
-                        del windspeed_avg10m[0]
-                    windspeed_avg2m.append(wind)
-                    windspeed_avg10m.append(wind)
-                    data[item]['1'] = wind
-                    data[item]['2'] = max(windspeed_avg2m)
-                    data[item]['3'] = round(np.mean(windspeed_avg2m),2)
-                    data[item]['4'] = round(np.mean(windspeed_avg10m),2)
-                # Winddir
-                elif item == "winddir":
-                    volt = round( float(message.payload),1 )
-                    while len(winddir_avg2m) > 39: # Interval 3 sec, 40 values
-                        del winddir_avg2m[0]
-                    while len(winddir_avg10m) > 199: # Interval 3 sec, 200 values
-                        del winddir_avg10m[0]
-                    if str(volt) in sensors[item]['converttable']:
-                        data[item]['1'] = sensors[item]['converttable'][str(volt)]
-                        winddir_avg2m.append(float(data[item]['1']))
-                        winddir_avg10m.append(float(data[item]['1']))
-                    else:
-                        data[item]['1'] = -9999
-                        if len(winddir_avg10m) > 0 and len(winddir_avg2m) > 0:
-                            last = winddir_avg2m[-1]
-                            winddir_avg2m.append(float(last))
-                            last = winddir_avg10m[-1]
-                            winddir_avg10m.append(float(last))
-                    data[item]['2'] = avgwind(winddir_avg2m)
-                    data[item]['3'] = avgwind(winddir_avg10m)
-                # Solar Radiation
-                elif item == "solarradiation":
-                    value = float(message.payload)
-                    if 'offset' in sensors[item] and sensors[item]['offset'] is not None:
-                        value = value - float(sensors[item]['offset'])
-                    if float(value) < 0:
-                        value = 0
-                    data[item]['1'] = "-9999"
-                    if 'max' in sensors[item]:
-                        if float(sensors[item]['max']) > 0 and sensors[item]['max'] is not None:
-                            sr = round( (float(value) * 1000) / float(sensors[item]['max']) * 1000,1)
-                            if sr < 0.6:
-                                data[item]['1'] = 0
-                            else:
-                                data[item]['1'] = round( float(sr),1)
-                # Rain State
-                elif item == "rainstate":
-                    input = message.payload.decode("utf-8")
-                    data.setdefault(item, {}).setdefault('cur_state',0)
-                    if str(input) == "ON":
-                        data[item]['1'] = 1
-                        data['rainstate']['cur_state'] = 1
-                    else:
-                        data[item]['1'] = 0
-                        data['rainstate']['cur_state'] = 0
-                # Rain Rate
-                elif item == "rainrate":
-                    data.setdefault('rainstate', {}).setdefault('cur_state',0)
-                    x = datetime.datetime.now()
-                    rainrate = mmtoin(float(message.payload) * 6,3) # Rate is mm/10m, so factor 6 for mm/hr
-                    amount = mmtoin(float(message.payload),3) # Amount in the last 10 minutes
-                    if float(sensors['rainstate']['calc_rr']) > 0 and float(data['rainstate']['cur_state']) > 0 and rainrate < 0.5: # Calculate rainrate from rainstate
-                        rainrate = mmtoin(float(0.5),3) # 0.5 mm/hr
-                        amount = mmtoin(float(0.083),3) # 0.5mm/h, Amount in the last 10 minutes
-                    ret = rainstats(x, rainrate, amount)
-                    data[item]['1'] = rainrate
-                    data[item]['2'] = float(ret['2'])
-                    data[item]['3'] = float(ret['3'])
-                    data[item]['4'] = float(ret['4'])
-                    data[item]['5'] = float(ret['5'])
-                    data[item]['6'] = float(ret['6'])
-                    data[item]['7'] = float(ret['7'])
-                    data[item]['8'] = float(ret['8'])
-                    data[item]['9'] = float(ret['9'])
-                # Lightning Last
-                elif item == "lightning_last":
-                    try:
-                        x = datetime.datetime.utcfromtimestamp(float(message.payload)) # Convert to UTC
-                        last =  int(x.timestamp())
-                        if last < 0:
-                            last = 0
-                        data[item]['1'] = str( last )
-                    except:
-                        data[item]['1'] = 0
-                # Lightning Distance
-                elif item == "lightning_distance":
-                    data[item]['1'] = round(float(message.payload),1)
-                # Lightning Number
-                elif item == "lightning_number":
-                    x = datetime.datetime.now()
-                    number = float(message.payload)
-                    if number < int(historydata['lightning']['offset']): # Seems plugin was restarted
-                        historydata['lightning']['offset'] = 0
-                    amount = number - int(historydata['lightning']['offset'])
-                    ret = lightningstats(x, number, amount)
-                    data[item]['1'] = int(number)
-                    data[item]['2'] = int(ret['2'])
-                    data[item]['3'] = int(ret['3'])
-                    data[item]['4'] = int(ret['4'])
-                    data[item]['5'] = int(ret['5'])
-                    data[item]['6'] = int(ret['6'])
-                    data[item]['7'] = int(ret['7'])
-                    data[item]['8'] = int(ret['8'])
-                    data[item]['9'] = int(ret['9'])
-
-
-                # Save new current data
-                for val in data[item]:
-                    if 'name'+val in sensors[item] and data[item][val] is not None:
-                        sensorvalues[str(sensors[item]['name'+val])] = data[item][val]
-                        log.debug("Received Measurement " + item + " (Converted): " + str(sensors[item]['name'+val]) + " " + str(data[item][val]))
-                #data[item].clear()
-                log.debug("Stored History Data: " + str(historydata))
-                log.debug("Stored Windspeed AVG2m Data: " + str(windspeed_avg2m))
-                log.debug("Stored Windspeed AVG10m Data: " + str(windspeed_avg10m))
-                log.debug("Stored Winddir AVG2m Data: " + str(winddir_avg2m))
-                log.debug("Stored Winddir AVG10m Data: " + str(winddir_avg10m))
-
-    # Loop
-    now = datetime.datetime.now()
-
-    # Reset / calculate some historical data
-    # Rain
-    if float(now.timestamp()) > float(historydata['rain']['event']['last']) + 86400: # Event, https://www.wetterstationsforum.info/viewtopic.php?t=241
-        historydata['rain']['event']['amount'] = 0
-    y = datetime.datetime.fromtimestamp(float(historydata['rain']['hourly']['last']))
-    if now.strftime("%H") != y.strftime("%H"): # Hourly
-        historydata['rain']['hourly']['amount'] = 0
-    if now.strftime("%j") != y.strftime("%j"): # Daily
-        historydata['rain']['daily']['amount'] = 0
-    if now.strftime("%W") != y.strftime("%W"): # Weekly
-        historydata['rain']['weekly']['amount'] = 0
-    if now.strftime("%m") != y.strftime("%m"): # Monthly
-        historydata['rain']['monthly']['amount'] = 0
-    for hour in list(historydata['rain']['24h']): # 24h
-        if float(now.timestamp()) > float(hour) + 86400:
-            del historydata['rain']['24h'][hour]
-    for minute in list(historydata['rain']['1h']): # 1h
-        if float(now.timestamp()) > float(minute) + 3600:
-            del historydata['rain']['1h'][minute]
-    # Lightning
-    if float(now.timestamp()) > float(historydata['lightning']['event']['last']) + 86400: # Event, https://www.wetterstationsforum.info/viewtopic.php?t=241
-        historydata['lightning']['event']['amount'] = 0
-    y = datetime.datetime.fromtimestamp(float(historydata['lightning']['hourly']['last']))
-    if now.strftime("%H") != y.strftime("%H"): # Hourly
-        historydata['lightning']['hourly']['amount'] = 0
-    if now.strftime("%j") != y.strftime("%j"): # Daily
-        historydata['lightning']['daily']['amount'] = 0
-    if now.strftime("%W") != y.strftime("%W"): # Weekly
-        historydata['lightning']['weekly']['amount'] = 0
-    if now.strftime("%m") != y.strftime("%m"): # Monthly
-        historydata['lightning']['monthly']['amount'] = 0
-    for hour in list(historydata['lightning']['24h']): # 24h
-        if float(now.timestamp()) > float(hour) + 86400:
-            del historydata['lightning']['24h'][hour]
-    for minute in list(historydata['lightning']['1h']): # 1h
-        if float(now.timestamp()) > float(minute) + 3600:
-            del historydata['lightning']['1h'][minute]
-
-    # Send data every x seconds
-    if float(now.timestamp()) > float(lastsend) + float(pconfig['ecowittinterval']):
-        lastsend = float(now.timestamp())
-        sensorvalues['dateutc'] = str( datetime.datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S") )
+    try:
+        messages = [q.get(timeout=max(0, nextrun - time.time()))]
+    except Empty:
+        messages = []
+    if metrics is not None:
+        metrics.high('w4l_queue_depth_max', q.qsize() + len(messages))
+
+    # Process all subscribed messages in the queue in one batch
+    # (limited, so housekeeping and sinks are not starved by a backlog)
+    while messages and len(messages) < MAXBATCH:
         try:
-            url = pconfig['ecowittserver'] + ":" + pconfig['ecowittport'] + '/data/report/'
-            response = requests.post(url, data = sensorvalues)
-            log.debug("Response from Server: " + response.text)
-        except requests.exceptions.RequestException as e:
-            log.critical("Cannot send data to Ecowitt server! Error: " + str(e))
+            messages.append(q.get_nowait())
+        except Empty:
+            break
+    count = len(messages)
+    oldest = float('inf')
+    # A reload request (SIGHUP) is queued, so it is applied between two messages
+    while RELOAD in messages:
+        i = messages.index(RELOAD)
+        oldest = min(oldest, processmessages(messages[:i]))
+        for pipeline in reloadconfig():
+            pipeline.stop()
+        messages = messages[i + 1:]
+    if messages:
+        oldest = min(oldest, processmessages(messages))
 
-    time.sleep(0.1)
+    now = datetime.datetime.now()
+    catchup = catchingup(count, oldest, now.timestamp())
+
+    if now.timestamp() >= nextrun:
+        if configchanged(now.timestamp()):
+            for pipeline in reloadconfig():
+                pipeline.stop()
+        housekeeping(now)
+        # Send data every x seconds (each sink has its own interval), after a backlog only its final values
+        if not catchup:
+            for station in stations:
+                station.sinks.publish(now.timestamp(), station.sensorvalues)
+        if now.timestamp() >= nextstatus:
+            publishstatus(now.timestamp())
+
+    nextrun = nextdeadline(now.timestamp())
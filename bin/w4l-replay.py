@@ -0,0 +1,258 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+# Record MQTT messages of the weather station and replay them through the
+# message processing core of w4l-gateway.py with a fake clock.
+#
+# Record:  w4l-replay.py --record=messages.jsonl [--duration=3600]
+# Replay:  w4l-replay.py --replay=messages.jsonl [--config=weather4lox.cfg]
+#              [--golden=golden.jsonl | --write-golden=golden.jsonl]
+#              [--repeat=10] [--batch=50] [--memory] [--tz=Europe/Berlin]
+#
+# Records are JSON lines {"ts": <epoch>, "topic": "...", "payload": "..."}
+# (binary payloads as "payload64"). The golden file contains the output
+# values of every message, so a replay proves that a change did not alter
+# any computed value. With --batch, N consecutive messages are converted
+# at once like a queue backlog in the gateway (one output per batch); the
+# golden file (always written without --batch) is then compared as the
+# current values after the last message of every batch.
+
+import os
+import sys
+import json
+import time
+import base64
+import logging
+import getopt
+import signal
+import datetime
+import tracemalloc
+from w4lgateway.station import Station
+from w4lgateway import config
+from w4lgateway import lbenv
+
+#############################################################################
+# Functions
+#############################################################################
+
+def record(file, topic, duration):
+    import paho.mqtt.client as mqtt
+    (lbvalues, lbsource) = lbenv.resolve(os.path.dirname(os.path.abspath(__file__)))
+    f = open(file, 'a')
+    count = [0]
+
+    def on_message(client, userdata, message):
+        entry = {'ts': time.time(), 'topic': message.topic}
+        try:
+            entry['payload'] = message.payload.decode("utf-8")
+        except UnicodeDecodeError:
+            entry['payload64'] = base64.b64encode(message.payload).decode("ascii")
+        f.write(json.dumps(entry) + "\n")
+        count[0] += 1
+
+    client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION1)
+    client.on_message = on_message
+    if lbvalues['brokeruser'] and lbvalues['brokerpass']:
+        client.username_pw_set(username = lbvalues['brokeruser'], password = lbvalues['brokerpass'])
+    client.connect(lbvalues['brokerhost'], port = int(lbvalues['brokerport'] or 1883))
+    client.subscribe(topic + "/#", qos=0)
+    print("Recording %s/# to %s. Stop with Ctrl-C." % (topic, file))
+    signal.signal(signal.SIGTERM, lambda a, b: sys.exit())
+    start = time.time()
+    client.loop_start()
+    try:
+        while not duration or time.time() < start + duration:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    client.loop_stop()
+    client.disconnect()
+    f.close()
+    print("Recorded %d messages." % count[0])
+
+def readrecords(file):
+    records = list()
+    with open(file) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if 'payload64' in entry:
+                payload = base64.b64decode(entry['payload64'])
+            else:
+                payload = str(entry.get('payload', "")).encode("utf-8")
+            records.append((float(entry['ts']), entry['topic'], payload))
+    return records
+
+def nextrollover(ts):                                     # Next full hour
+    x = datetime.datetime.fromtimestamp(ts)
+    return (x.replace(minute=0, second=0, microsecond=0) + datetime.timedelta(hours=1)).timestamp()
+
+def replay(station, records, repeat, batch=1):
+    """Feed all records through the station. Returns (outputs, elapsed)."""
+    outputs = list()
+    span = records[-1][0] - records[0][0] + 1 if records else 0
+    nextrun = 0
+    start = time.perf_counter()
+    for n in range(repeat):
+        shift = n * span                                  # Repetitions continue in time
+        if batch > 1:
+            for i in range(0, len(records), batch):
+                messages = [(topic, payload, ts + shift) for (ts, topic, payload) in records[i:i + batch]]
+                ts = messages[0][2]
+                if ts >= nextrun:
+                    station.housekeeping(datetime.datetime.fromtimestamp(ts))
+                outputs.append(station.processbatch(messages))
+                nextrun = min(nextrollover(messages[-1][2]), station.deadline()) + 0.01
+            continue
+        for (ts, topic, payload) in records:
+            ts = ts + shift
+            if ts >= nextrun: # Housekeeping was due before this message arrived
+                station.housekeeping(datetime.datetime.fromtimestamp(ts))
+            outputs.append(station.process(topic, payload, ts))
+            nextrun = min(nextrollover(ts), station.deadline()) + 0.01 # Same deadlines as the gateway
+    return (outputs, time.perf_counter() - start)
+
+def percentile(values, p):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))]
+
+def currentvalues(outputs, every=1):                      # Current values after every N-th output
+    state = dict()
+    ret = list()
+    for (i, values) in enumerate(outputs):
+        state.update(values)
+        if (i + 1) % every == 0 or i == len(outputs) - 1:
+            ret.append(dict(state))
+    return ret
+
+def comparegolden(file, outputs, batch=1):
+    with open(file) as f:
+        golden = [json.loads(line) for line in f if line.strip()]
+    if batch > 1: # Per message golden vs. one output per batch
+        golden = currentvalues(golden, batch)
+        outputs = currentvalues(outputs)
+    errors = 0
+    if len(golden) != len(outputs):
+        print("Golden file has %d messages, replay produced %d." % (len(golden), len(outputs)))
+        errors += 1
+    for (i, (expected, got)) in enumerate(zip(golden, outputs)):
+        got = json.loads(json.dumps(got))
+        if expected != got:
+            errors += 1
+            if errors <= 10:
+                print("Message %d differs:\n  golden: %s\n  replay: %s" % (i, json.dumps(expected, sort_keys=True), json.dumps(got, sort_keys=True)))
+    return errors
+
+#############################################################################
+# Main Script
+#############################################################################
+
+recordfile = ""
+replayfile = ""
+configfile = ""
+golden = ""
+writegolden = ""
+duration = 0
+repeat = 1
+batch = 1
+memory = 0
+
+short_options = "r:p:c:g:w:d:n:b:mt:"
+long_options = ["record=","replay=","config=","golden=","write-golden=","duration=","repeat=","batch=","memory","tz="]
+
+try:
+    arguments, values = getopt.getopt(sys.argv[1:], short_options, long_options)
+except getopt.error as err:
+    print (str(err))
+    sys.exit(2)
+
+for current_argument, current_value in arguments:
+    if current_argument in ("-r", "--record"):
+        recordfile = current_value
+    elif current_argument in ("-p", "--replay"):
+        replayfile = current_value
+    elif current_argument in ("-c", "--config"):
+        configfile = current_value
+    elif current_argument in ("-g", "--golden"):
+        golden = current_value
+    elif current_argument in ("-w", "--write-golden"):
+        writegolden = current_value
+    elif current_argument in ("-d", "--duration"):
+        duration = float(current_value)
+    elif current_argument in ("-n", "--repeat"):
+        repeat = max(1, int(current_value))
+    elif current_argument in ("-b", "--batch"):
+        batch = max(1, int(current_value))
+    elif current_argument in ("-m", "--memory"):
+        memory = 1
+    elif current_argument in ("-t", "--tz"):
+        os.environ['TZ'] = current_value
+        time.tzset()
+
+if not configfile:
+    (lbvalues, lbsource) = lbenv.resolve(os.path.dirname(os.path.abspath(__file__)))
+    configfile = lbvalues['lbpconfigdir'] + '/weather4lox.cfg'
+try:
+    (cfg, pconfig, sensors) = config.readconfig(configfile)
+except OSError as e:
+    print(str(e))
+    sys.exit(2)
+topic = cfg.get('SERVER','TOPIC')
+
+if recordfile:
+    record(recordfile, topic, duration)
+    sys.exit(0)
+
+if not replayfile:
+    print("No action specified. --record=FILE or --replay=FILE is required.")
+    sys.exit(2)
+if writegolden and (batch > 1 or repeat > 1):
+    print("Golden files are written per message, without --batch and --repeat.")
+    sys.exit(2)
+
+# Conversion errors of recorded payloads are expected, keep the report readable
+logging.getLogger().setLevel(logging.CRITICAL)
+
+records = readrecords(replayfile)
+station = Station()
+station.configure(sensors, topic)
+station.loadhistory()
+station.timings = dict()
+
+if memory:
+    tracemalloc.start()
+    memstart = tracemalloc.get_traced_memory()[0]
+(outputs, elapsed) = replay(station, records, repeat, batch)
+if memory:
+    (memend, mempeak) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+# Report
+count = len(records) * repeat
+print("Messages:         %d (%d x %d)" % (count, len(records), repeat))
+print("Elapsed:          %.3f s" % elapsed)
+print("Messages/second:  %.0f" % (count / elapsed if elapsed > 0 else 0))
+print("Handler latency per sensor (microseconds):")
+print("  %-20s %8s %8s %8s %8s %8s" % ("sensor", "count", "p50", "p90", "p99", "max"))
+for item in sorted(station.timings):
+    t = station.timings[item]
+    print("  %-20s %8d %8.1f %8.1f %8.1f %8.1f" % (item, len(t), percentile(t, 50) * 1e6,
+        percentile(t, 90) * 1e6, percentile(t, 99) * 1e6, max(t) * 1e6))
+if memory:
+    print("Memory growth:    %.1f KiB (peak %.1f KiB)" % ((memend - memstart) / 1024.0, (mempeak - memstart) / 1024.0))
+
+# Golden files
+if writegolden:
+    with open(writegolden, 'w') as f:
+        for values in outputs:
+            f.write(json.dumps(values, sort_keys=True) + "\n")
+    print("Golden file %s written." % writegolden)
+if golden:
+    errors = comparegolden(golden, outputs, batch)
+    if errors:
+        print("Golden check FAILED: %d differences." % errors)
+        sys.exit(1)
+    print("Golden check passed.")
@@ -0,0 +1,2 @@
+# -*- coding: utf-8 -*-
+# Helper modules for w4l-gateway.py
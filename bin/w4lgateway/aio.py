@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+# asyncio mode of the gateway: MQTT, sinks and metrics in one event loop
+
+import time
+import asyncio
+import inspect
+import logging
+import threading
+
+from w4lgateway.sinks import Sink, EcowittSink, MqttSink, LoxoneUdpSink
+
+log = logging.getLogger()
+
+class AsyncMqtt:
+    """Drive a paho client from the asyncio event loop instead of loop_start().
+
+    The client socket is watched with add_reader/add_writer. Received
+    messages go to an asyncio.Queue; if more than highwater messages are
+    waiting, reading from the socket pauses until the queue is drained to
+    half, so a backlog stays in the TCP buffers / the broker instead of
+    the memory of the gateway.
+
+    Reconnects run in an executor thread (the TCP / TLS connect of paho
+    blocks) with an exponential back-off like the threaded paho loop, so a
+    lost broker does not stall the sinks and the metrics endpoint.
+    """
+
+    def __init__(self, client, loop, highwater=10000, mindelay=1, maxdelay=120):
+        self.client = client
+        self.loop = loop
+        self.thread = threading.get_ident()               # Thread of the event loop
+        self.queue = asyncio.Queue()
+        self.highwater = highwater
+        self.mindelay = mindelay
+        self.maxdelay = maxdelay
+        self.delay = mindelay                             # Back-off of the next failed reconnect
+        self.sock = None
+        self.paused = False
+        self.misctask = None
+        client.on_socket_open = self.on_socket_open
+        client.on_socket_close = self.on_socket_close
+        client.on_socket_register_write = self.on_socket_register_write
+        client.on_socket_unregister_write = self.on_socket_unregister_write
+
+    def call(self, callback, *args):                      # Socket callbacks may come from the reconnect thread
+        if threading.get_ident() == self.thread:
+            callback(*args)
+        else:
+            self.loop.call_soon_threadsafe(callback, *args)
+
+    def on_socket_open(self, client, userdata, sock):
+        self.call(self.opened, sock)
+
+    def opened(self, sock):
+        self.sock = sock
+        self.paused = False
+        self.loop.add_reader(sock, self.client.loop_read)
+        if self.misctask is None:
+            self.misctask = self.loop.create_task(self.misc())
+
+    def on_socket_close(self, client, userdata, sock):
+        self.call(self.closed, sock)
+
+    def closed(self, sock):
+        self.loop.remove_reader(sock)
+        if self.sock is sock:
+            self.sock = None
+
+    def on_socket_register_write(self, client, userdata, sock):
+        self.call(self.loop.add_writer, sock, client.loop_write)
+
+    def on_socket_unregister_write(self, client, userdata, sock):
+        self.call(self.loop.remove_writer, sock)
+
+    def on_message(self, client, userdata, message):
+        self.queue.put_nowait((time.time(), message))
+        if not self.paused and self.sock is not None and self.queue.qsize() >= self.highwater:
+            log.warning("MQTT: %d messages waiting, pausing reception.", self.queue.qsize())
+            self.pause()
+
+    def pause(self):                                      # Stop reading, sending goes on
+        if not self.paused and self.sock is not None:
+            self.loop.remove_reader(self.sock)
+        self.paused = True
+
+    def resume(self):                                     # Called after the queue was drained
+        if self.paused and self.queue.qsize() <= self.highwater // 2:
+            self.paused = False
+            if self.sock is not None:
+                self.loop.add_reader(self.sock, self.client.loop_read)
+
+    async def misc(self):                                 # Keep-alive pings and reconnects
+        retryat = 0
+        while True:
+            rc = self.client.loop_misc()
+            if rc != 0 and self.sock is None and time.time() >= retryat:
+                try:
+                    await self.loop.run_in_executor(None, self.client.reconnect)
+                    self.delay = self.mindelay
+                except OSError as e:
+                    log.error("MQTT: Reconnect failed: %s. Next try in %d seconds.", e, self.delay)
+                    retryat = time.time() + self.delay
+                    self.delay = min(self.delay * 2, self.maxdelay)
+            await asyncio.sleep(1)
+
+    async def close(self):
+        if self.misctask is not None:
+            self.misctask.cancel()
+        self.client.disconnect()
+        # Let the event loop write the DISCONNECT packet
+        for i in range(10):
+            if self.sock is None:
+                break
+            await asyncio.sleep(0.05)
+
+class AsyncSink(Sink):
+    """Sink running as asyncio task instead of a thread.
+
+    Same latest-snapshot, deadband, retry and statistics behaviour as
+    Sink. send() may be a coroutine or a plain (non-blocking) function.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.wakeup = asyncio.Event()
+        self.task = None
+
+    def start(self):
+        self.running = True
+        self.task = asyncio.get_running_loop().create_task(self.run())
+
+    def submit(self, snapshot, now=None):
+        super().submit(snapshot, now)
+        self.wakeup.set()
+
+    async def stop(self, timeout=5):
+        """Stop the sender. A pending snapshot gets one last try."""
+        self.running = False
+        self.retryat = 0
+        self.wakeup.set()
+        if self.task is not None:
+            try:
+                await asyncio.wait_for(self.task, timeout)
+            except asyncio.TimeoutError:
+                log.error("Cannot send pending data to %s in time.", self.name)
+        result = self.close()
+        if inspect.isawaitable(result):
+            await result
+
+    async def run(self):
+        while True:
+            while self.running and (self.pending is None or time.time() < self.retryat):
+                self.wakeup.clear()
+                timeout = None if self.pending is None else max(0, self.retryat - time.time())
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+            if self.pending is None:
+                return
+            snapshot = self.pending
+            attempt = self.attempt
+            running = self.running
+            ok = await self.timedsend(snapshot)
+            self.finish(snapshot, attempt, running, ok)
+            if not running:
+                return
+
+    async def timedsend(self, snapshot):
+        start = time.time()
+        try:
+            ok = self.send(snapshot)
+            if inspect.isawaitable(ok):
+                ok = await ok
+        except Exception as e:
+            log.critical("Cannot send data to %s! Error: %s", self.name, e)
+            ok = False
+        return self.record(ok, time.time() - start)
+
+class AsyncEcowittSink(AsyncSink, EcowittSink):
+    """EcowittSink with the blocking requests POST in an executor thread.
+
+    Only the HTTP request leaves the event loop, the latest-snapshot,
+    retry and statistics handling stays on it.
+    """
+
+    async def send(self, snapshot):
+        return await asyncio.get_running_loop().run_in_executor(None, EcowittSink.send, self, snapshot)
+
+class AsyncMqttSink(AsyncSink, MqttSink):
+    """MqttSink on the event loop (publish() only queues the packets)."""
+
+class AsyncLoxoneUdpSink(AsyncSink, LoxoneUdpSink):
+    """LoxoneUdpSink on the event loop (UDP sends do not block)."""
+
+async def stoppipeline(pipeline):                         # Flush and stop all sinks of a Pipeline
+    await asyncio.gather(*[sink.stop() for sink in pipeline.sinks])
+
+async def servemetrics(metrics, host, port):
+    """Serve /metrics with asyncio.start_server."""
+
+    async def handle(reader, writer):
+        try:
+            request = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), 10)
+            path = request.split(b" ")[1].decode("latin-1").split("?")[0]
+            if path in ("/", "/metrics"):
+                body = metrics.prometheus().encode("utf-8")
+                head = "HTTP/1.1 200 OK\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            else:
+                body = b"Not found\n"
+                head = "HTTP/1.1 404 Not Found\r\nContent-Type: text/plain\r\n"
+            writer.write((head + "Content-Length: %d\r\nConnection: close\r\n\r\n" % len(body)).encode("latin-1") + body)
+            await writer.drain()
+        except (OSError, IndexError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError):
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, host, int(port))
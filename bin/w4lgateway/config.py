@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+# Gateway configuration from weather4lox.cfg
+
+from configparser import ConfigParser
+
+DEFAULTS = {
+    'ecowittinterval': 60,
+    'ecowittconnecttimeout': 3,
+    'ecowittreadtimeout': 10,
+    'ecowittmode': "full",
+    'mqttpublishinterval': 10,
+    'mqttpublishmode': "changes",
+    'loxoneudpinterval': 10,
+    'loxoneudpmode': "changes",
+    'sinkretries': 5,
+    'publishmaxage': 300,
+    'historyinterval': 300,
+    'historyjournal': 1,
+    'historyyears': 10,
+    'metricshost': "127.0.0.1",
+    'metricsinterval': 60,
+    'statedumpinterval': 60,
+    'batchingest': 1,
+    'asyncio': 0,
+    'timeseries': 0,
+    'timeseriesinterval': 60,
+    'timeseriesresolution': 10,
+    'timeseriesdays': 30,
+    'hourlyhistoryhours': 48,
+    'configwatch': 0,
+    'mqttqos': 0,
+    'mqttsessionexpiry': 604800,
+    'sourcetime': "receive",
+    'sourcetimejson': "Time",
+    'sourcetimeproperty': "ts",
+    'catchupage': 10,
+    'snapshot': 1,
+    'snapshotfile': "/dev/shm/weather4lox.snapshot",
+    'snapshotslots': 256,
+}
+
+def settings(cfg, section):                              # Gateway settings with defaults
+    pconfig = dict(cfg.items(section)) if cfg.has_section(section) else dict()
+    for key in DEFAULTS:
+        if pconfig.get(key, "") == "":
+            pconfig[key] = DEFAULTS[key]
+    return pconfig
+
+def sensorsections(cfg, prefix):                         # Sensor sections [<prefix><item>]
+    sensors = dict()
+    for section in cfg.sections():
+        if section.upper().startswith(prefix):
+            sensors[section[len(prefix):].lower()] = dict(cfg.items(section))
+    return sensors
+
+def readconfig(file):
+    """Return (cfg, pconfig, sensors) from the plugin config file.
+
+    pconfig are the gateway settings of section [GATEWAY]. Sensors are
+    configured in one section [SENSOR_<item>] per sensor, e.g. [SENSOR_TEMP],
+    with TOPIC and NAMEn (output name of value n), optional JSON=<path> to
+    take the value from a JSON document on TOPIC, DEADBANDn
+    (absolute or relative "2%") and MAXAGEn for change driven publishing.
+    [SENSOR_DERIVED] has no TOPIC, only NAME1..4 for dew point, heat index,
+    wind chill and feels-like (e.g. dewptf, heatindexf, windchillf,
+    feelslikef) computed from temp, humidity and windspeed.
+    """
+    cfg = ConfigParser()
+    if not cfg.read(file):
+        raise OSError("Cannot read " + file)
+    return (cfg, settings(cfg, 'GATEWAY'), sensorsections(cfg, 'SENSOR_'))
+
+def readstations(cfg, pconfig, sensors):
+    """Return [(name, topic, pconfig, sensors)] of all stations.
+
+    The main station uses [SERVER] TOPIC, [GATEWAY] and [SENSOR_<item>].
+    Further stations are listed in [GATEWAY] STATIONS=<name>,<name>. Each
+    has its own section [STATION_<name>] with TOPIC and the same settings
+    as [GATEWAY] (sinks, history), and sensors [STATION_<name>_SENSOR_<item>].
+    """
+    stations = [("main", cfg.get('SERVER', 'TOPIC'), pconfig, sensors)]
+    for name in str(pconfig.get('stations', "")).split(','):
+        name = name.strip().upper()
+        if not name:
+            continue
+        section = 'STATION_' + name
+        section = next((x for x in cfg.sections() if x.upper() == section), section)
+        if not cfg.has_section(section) or not cfg.get(section, 'TOPIC', fallback=""):
+            raise ValueError("Station " + name + " needs a section [STATION_" + name + "] with TOPIC")
+        stations.append((name.lower(), cfg.get(section, 'TOPIC').strip("/"), settings(cfg, section), sensorsections(cfg, section.upper() + '_SENSOR_')))
+    return stations
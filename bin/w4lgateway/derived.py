@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+# Derived quantities: dew point, heat index, wind chill and feels-like
+
+import numpy as np
+
+# All functions take and return Fahrenheit / mph like the converted sensor
+# values and work element wise on scalars as well as on numpy arrays (e.g.
+# replayed messages or series of the TimeSeriesStore). Scalars are kept as
+# plain floats, numpy on 0-d arrays would be far slower in the message path.
+
+SCALARS = (int, float, np.number)
+
+def values(x):
+    if isinstance(x, SCALARS):
+        return float(x)
+    return np.asarray(x, dtype=float)
+
+def clip(x, lower, upper=None):                           # np.clip() for scalars too
+    if isinstance(x, float):
+        x = max(x, lower)
+        return x if upper is None else min(x, upper)
+    return np.clip(x, lower, upper)
+
+def where(condition, a, b):                               # np.where() for scalars too
+    if isinstance(condition, (bool, np.bool_)):
+        return a if condition else b
+    return np.where(condition, a, b)
+
+def dewpoint(tempf, humidity):
+    """Dew point (Magnus formula, Sonntag 1990 coefficients)."""
+    t = (values(tempf) - 32) * 5 / 9.0
+    rh = clip(values(humidity), 1, 100)
+    gamma = np.log(rh / 100.0) + 17.62 * t / (243.12 + t)
+    return 243.12 * gamma / (17.62 - gamma) * 9 / 5.0 + 32
+
+def heatindex(tempf, humidity):
+    """Heat index of the NWS (Rothfusz regression with its adjustments), the temperature itself below 80 F."""
+    # https://www.wpc.ncep.noaa.gov/html/heatindex_equation.shtml
+    t = values(tempf)
+    rh = values(humidity)
+    simple = 0.5 * (t + 61.0 + (t - 68.0) * 1.2 + rh * 0.094)
+    hi = (-42.379 + 2.04901523 * t + 10.14333127 * rh - 0.22475541 * t * rh
+          - 0.00683783 * t * t - 0.05481717 * rh * rh + 0.00122874 * t * t * rh
+          + 0.00085282 * t * rh * rh - 0.00000199 * t * t * rh * rh)
+    dry = (rh < 13) & (t >= 80) & (t <= 112)
+    hi = where(dry, hi - (13 - rh) / 4.0 * np.sqrt(clip(17 - abs(t - 95), 0) / 17.0), hi)
+    humid = (rh > 85) & (t >= 80) & (t <= 87)
+    hi = where(humid, hi + (rh - 85) / 10.0 * (87 - t) / 5.0, hi)
+    return where((simple + t) / 2 >= 80, hi, t)
+
+def windchill(tempf, windspeedmph):
+    """Wind chill of the NWS, the temperature itself outside its range."""
+    # https://www.weather.gov/media/epz/wxcalc/windChill.pdf
+    t = values(tempf)
+    v = clip(values(windspeedmph), 0)
+    wc = 35.74 + 0.6215 * t - 35.75 * v ** 0.16 + 0.4275 * t * v ** 0.16
+    return where((t <= 50) & (v >= 3), wc, t)
+
+def feelslike(tempf, humidity=None, windspeedmph=None, chill=None, hi=None):
+    """Wind chill when cold and windy, heat index when warm, else the temperature.
+
+    Without humidity there is no heat index, without wind speed the air is
+    taken as calm. chill and hi: wind chill and heat index if already known.
+    """
+    t = values(tempf)
+    if chill is None:
+        chill = t if windspeedmph is None else windchill(t, windspeedmph)
+    if hi is None:
+        hi = t if humidity is None else heatindex(t, humidity)
+    return where(t <= 50, chill, where(t >= 80, hi, t))
+
+def derive(tempf, humidity=None, windspeedmph=None):
+    """All quantities computable from the given inputs as {N: value(s)}.
+
+    1: dew point, 2: heat index, 3: wind chill, 4: feels-like. Without
+    humidity dew point and heat index are missing, without wind speed the
+    air is taken as calm.
+    """
+    t = values(tempf)
+    ret = dict()
+    if windspeedmph is not None:
+        ret['3'] = windchill(t, windspeedmph)
+    if humidity is not None:
+        ret['1'] = dewpoint(t, humidity)
+        ret['2'] = heatindex(t, humidity)
+    ret['4'] = feelslike(t, humidity, windspeedmph, ret.get('3'), ret.get('2'))
+    return ret
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+# Resolve LoxBerry directories, plugin version and MQTT credentials
+
+import os
+import json
+import subprocess
+
+KEYS = ('lbpconfigdir', 'lbpdatadir', 'lbplogdir', 'pluginversion',
+        'brokerhost', 'brokerport', 'brokeruser', 'brokerpass')
+
+# Fallback: one Perl call for all values
+PERL = ("use LoxBerry::System; use LoxBerry::IO; use JSON::PP; "
+        "my $mqttcred = LoxBerry::IO::mqtt_connectiondetails(); "
+        "print JSON::PP->new->encode({ "
+        "lbpconfigdir => $lbpconfigdir, lbpdatadir => $lbpdatadir, lbplogdir => $lbplogdir, "
+        "pluginversion => LoxBerry::System::pluginversion(), "
+        "brokerhost => $mqttcred->{brokerhost}, brokerport => $mqttcred->{brokerport}, "
+        "brokeruser => $mqttcred->{brokeruser}, brokerpass => $mqttcred->{brokerpass} }); exit;")
+
+def readjson(file):
+    try:
+        with open(file) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return dict()
+
+def lbhome():
+    return os.environ.get('LBHOMEDIR') or os.path.expanduser('~loxberry')
+
+def generaljson():
+    sconfig = os.environ.get('LBSCONFIG') or os.path.join(lbhome(), 'config', 'system')
+    return readjson(os.path.join(sconfig, 'general.json'))
+
+def native(bindir):
+    """Values from the LoxBerry environment and config files (no Perl)."""
+    ret = dict()
+    # Scripts are installed to $LBHOMEDIR/bin/plugins/<plugindir>
+    bindir = os.path.realpath(bindir)
+    plugindir = os.path.basename(bindir)
+    if os.path.basename(os.path.dirname(bindir)) != 'plugins':
+        return ret
+    home = lbhome()
+    if not os.path.isdir(home):
+        return ret
+    ret['lbpconfigdir'] = os.path.join(os.environ.get('LBPCONFIG') or os.path.join(home, 'config', 'plugins'), plugindir)
+    ret['lbpdatadir'] = os.path.join(os.environ.get('LBPDATA') or os.path.join(home, 'data', 'plugins'), plugindir)
+    ret['lbplogdir'] = os.path.join(os.environ.get('LBPLOG') or os.path.join(home, 'log', 'plugins'), plugindir)
+    # Plugin version from the plugin database
+    plugins = readjson(os.path.join(home, 'data', 'system', 'plugindatabase.json')).get('plugins', {})
+    for plugin in plugins.values():
+        if plugin.get('folder') == plugindir and plugin.get('version'):
+            ret['pluginversion'] = str(plugin['version'])
+    # MQTT connection details from the general config
+    mqtt = generaljson().get('Mqtt', {})
+    if mqtt.get('Brokerhost'):
+        ret['brokerhost'] = str(mqtt['Brokerhost'])
+        ret['brokerport'] = str(mqtt.get('Brokerport') or 1883)
+        ret['brokeruser'] = str(mqtt.get('Brokeruser') or "")
+        ret['brokerpass'] = str(mqtt.get('Brokerpass') or "")
+    return ret
+
+def perl():
+    """Values from LoxBerry::System / LoxBerry::IO in one Perl call."""
+    try:
+        out = subprocess.run(['perl', '-e', PERL], capture_output=True, text=True, timeout=60).stdout
+        ret = json.loads(out)
+    except (OSError, ValueError, subprocess.SubprocessError):
+        return dict()
+    return dict((key, "" if ret.get(key) is None else str(ret[key])) for key in KEYS)
+
+def resolve(bindir):
+    """Return (values, source). Perl is only used if native lookup is incomplete."""
+    ret = native(bindir)
+    if all(key in ret for key in KEYS):
+        return (ret, "native")
+    fallback = perl()
+    for key in KEYS:
+        ret.setdefault(key, fallback.get(key, ""))
+    return (ret, "perl")
+
+def miniserver(msno):
+    """IP address of Miniserver msno from the general config."""
+    ms = generaljson().get('Miniserver', {}).get(str(msno), {})
+    return str(ms.get('Ipaddress') or "")
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+# Counters and histograms of the gateway hot path
+
+import json
+import time
+import bisect
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+log = logging.getLogger()
+
+HANDLERBUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.01)
+LATENCYBUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+MAXTOPICS = 50                                            # Max. distinct unmatched topics
+
+class Histogram:
+    """Cumulative histogram with fixed bucket bounds (Prometheus "le")."""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        total = 0
+        for (le, count) in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            yield (le, total)
+
+class Metrics:
+    """Registry of counters, histograms and gauges.
+
+    Updating a counter or histogram is a dict lookup and an addition.
+    Everything else (gauges, sink statistics, formatting) is only done
+    when the metrics are scraped or published.
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.counters = dict()                            # (name, labels) -> value
+        self.histograms = dict()                          # (name, labels) -> Histogram
+        self.gauges = list()                              # callables returning [(name, labels, value)]
+        self.help = dict()
+
+    def describe(self, name, text):
+        self.help[name] = text
+
+    def inc(self, name, labels=(), value=1):
+        key = (name, labels)
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def high(self, name, value, labels=()):               # Keep the max. value seen
+        key = (name, labels)
+        if value > self.counters.get(key, 0):
+            self.counters[key] = value
+
+    def observe(self, name, labels, value, buckets=HANDLERBUCKETS):
+        key = (name, labels)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram(buckets)
+        histogram.observe(value)
+
+    def gauge(self, callback):
+        self.gauges.append(callback)
+
+    def message(self, station, sensor, seconds, count=1): # Converted measurement(s)
+        labels = (('station', station), ('sensor', sensor))
+        self.inc('w4l_messages_total', labels, count)
+        self.observe('w4l_handler_seconds', labels, seconds)
+
+    def unmatched(self, station, topic):                  # Message without sensor
+        labels = (('station', station), ('topic', topic))
+        if ('w4l_unmatched_messages_total', labels) not in self.counters:
+            if sum(1 for (name, l) in self.counters if name == 'w4l_unmatched_messages_total') >= MAXTOPICS:
+                labels = (('station', station), ('topic', 'other'))
+        self.inc('w4l_unmatched_messages_total', labels)
+
+    def samples(self):
+        """All current values as (name, labels, value)."""
+        ret = [('w4l_uptime_seconds', (), round(time.time() - self.started, 1))]
+        for (name, labels) in list(self.counters):
+            ret.append((name, labels, self.counters[(name, labels)]))
+        for (name, labels) in list(self.histograms):
+            histogram = self.histograms[(name, labels)]
+            for (le, count) in histogram.cumulative():
+                ret.append((name + '_bucket', labels + (('le', '+Inf' if le == float('inf') else repr(le)),), count))
+            ret.append((name + '_sum', labels, histogram.sum))
+            ret.append((name + '_count', labels, histogram.count))
+        for callback in self.gauges:
+            try:
+                ret.extend(callback())
+            except Exception as e:
+                log.error("Cannot read metrics: %s", e)
+        return ret
+
+    def prometheus(self):
+        """Prometheus text exposition format."""
+        lines = list()
+        described = set()
+        samples = self.samples()
+        histograms = set(name[:-7] for (name, labels, value) in samples if name.endswith('_bucket'))
+        for (name, labels, value) in sorted(samples, key=lambda s: s[0]):
+            base = name
+            for suffix in ('_bucket', '_sum', '_count'):
+                if name.endswith(suffix) and name[:-len(suffix)] in histograms:
+                    base = name[:-len(suffix)]
+            if base not in described:
+                described.add(base)
+                if base in self.help:
+                    lines.append("# HELP %s %s" % (base, self.help[base]))
+                kind = "histogram" if base in histograms else "counter" if base.endswith('_total') else "gauge"
+                lines.append("# TYPE %s %s" % (base, kind))
+            if labels:
+                label = ",".join('%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for (k, v) in labels)
+                lines.append("%s{%s} %s" % (name, label, value))
+            else:
+                lines.append("%s %s" % (name, value))
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        """Compact JSON status: counters, gauges and count/sum of the histograms."""
+        ret = dict()
+        for (name, labels, value) in self.samples():
+            if name.endswith('_bucket'):
+                continue
+            key = name + "".join("/" + str(v) for (k, v) in labels)
+            ret[key] = value
+        return json.dumps(ret, sort_keys=True)
+
+class MetricsServer:
+    """Serve /metrics over HTTP in a daemon thread."""
+
+    def __init__(self, metrics, port, host="127.0.0.1"):
+        registry = metrics
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = registry.prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, int(port)), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, name="metrics", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
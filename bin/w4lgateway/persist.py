@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+# Crash-safe persistence of history.json
+
+import os
+import json
+import time
+import logging
+
+from w4lgateway.stats import tojson
+
+log = logging.getLogger()
+
+LAYOUT = 2                                                # Layout of history.json, see data/history.format
+
+class HistoryStore:
+    """history.json with periodic atomic checkpoints and an optional journal.
+
+    Checkpoints are written to a temp file, fsync'ed and renamed over
+    history.json, so the file is never left half written. Between
+    checkpoints every increment is appended to history.journal. Journal
+    entries carry a sequence number; the checkpoint stores the last one it
+    contains, so entries are replayed exactly once after a restart.
+    Files of an older layout are converted by the Accumulators on load and
+    written in the current layout at the next checkpoint.
+    """
+
+    def __init__(self, filename, interval=300, journal=True):
+        self.filename = filename
+        self.journalname = os.path.splitext(filename)[0] + ".journal"
+        self.interval = float(interval)
+        self.usejournal = journal
+        self.journal = None
+        self.seq = 0
+        self.dirty = False
+        self.lastsave = time.time()
+
+    def load(self):
+        """Return the last checkpoint and the journal entries written after it."""
+        data = dict()
+        try:
+            with open(self.filename) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            log.info("Cannot read history data. Use default (empty) dataset")
+        except (OSError, ValueError) as e:
+            log.error("History data %s is damaged (%s). Use default (empty) dataset", self.filename, e)
+        self.seq = int(data.pop('seq', 0))
+        layout = int(data.pop('layout', 1))
+        if data and layout < LAYOUT:
+            log.info("Converting history data %s from layout %d to %d", self.filename, layout, LAYOUT)
+            self.dirty = True
+        entries = list()
+        try:
+            with open(self.journalname) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError: # Incomplete last line after a crash
+                        continue
+                    if int(entry.get('seq', 0)) > self.seq:
+                        entries.append(entry)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            log.error("Cannot read history journal %s: %s", self.journalname, e)
+        if entries:
+            self.seq = int(entries[-1]['seq'])
+            self.dirty = True
+            log.info("Recovered %d entries from history journal", len(entries))
+        return (data, entries)
+
+    def append(self, entry):
+        """Record one increment."""
+        self.dirty = True
+        if not self.usejournal:
+            return
+        self.seq += 1
+        entry['seq'] = self.seq
+        try:
+            if self.journal is None:
+                self.journal = open(self.journalname, 'a')
+            self.journal.write(json.dumps(entry, separators=(',', ':')) + "\n")
+            self.journal.flush()
+            os.fsync(self.journal.fileno())
+        except OSError as e:
+            log.error("Cannot write history journal: %s", e)
+
+    def deadline(self):
+        if not self.dirty:
+            return float('inf')
+        return self.lastsave + self.interval
+
+    def save(self, historydata):
+        """Write a checkpoint atomically and truncate the journal."""
+        data = dict(historydata)
+        data['layout'] = LAYOUT
+        data['seq'] = self.seq
+        tmp = self.filename + ".tmp"
+        try:
+            with open(tmp, 'w') as f:
+                f.write(json.dumps(data, separators=(',', ':'), default=tojson))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.filename)
+            dirfd = os.open(os.path.dirname(self.filename) or ".", os.O_RDONLY)
+            try:
+                os.fsync(dirfd)
+            finally:
+                os.close(dirfd)
+        except OSError as e:
+            log.critical("Cannot save history data: %s", e)
+            return False
+        # Checkpoint contains everything up to self.seq
+        try:
+            if self.journal is not None:
+                self.journal.close()
+                self.journal = None
+            if os.path.exists(self.journalname):
+                open(self.journalname, 'w').close()
+        except OSError as e:
+            log.error("Cannot truncate history journal: %s", e)
+        self.dirty = False
+        self.lastsave = time.time()
+        return True
+
+    def close(self):
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+# Time based rolling windows with O(1) updates
+
+from collections import deque
+from math import sin,cos,radians,degrees,atan2
+
+import numpy as np
+
+RESYNC = 10000                                            # Recalculate running sums after x samples
+
+class RollingWindow:
+    """Running mean and max of all samples not older than span seconds."""
+
+    def __init__(self, span):
+        self.span = float(span)
+        self.samples = deque()                            # (ts, value)
+        self.maxima = deque()                             # (ts, value), values decreasing
+        self.total = 0.0
+        self.count = 0
+
+    def __len__(self):
+        return len(self.samples)
+
+    def add(self, ts, value):
+        value = float(value)
+        self.samples.append((ts, value))
+        self.total += value
+        while self.maxima and self.maxima[-1][1] <= value:
+            self.maxima.pop()
+        self.maxima.append((ts, value))
+        self.count += 1
+        if self.count >= RESYNC: # Avoid drift of the running sum
+            self.count = 0
+            self.total = sum(v for (t, v) in self.samples)
+        self.expire(ts)
+
+    def extend(self, ts, values):
+        """Add a batch of samples (ordered by ts), same result as add() for each."""
+        values = np.asarray(values, dtype=float)
+        if not len(values):
+            return
+        ts = np.asarray(ts, dtype=float)
+        self.samples.extend(zip(ts.tolist(), values.tolist()))
+        self.total += float(values.sum())
+        # Only samples larger than all later samples of the batch can become the max
+        later = np.maximum.accumulate(values[::-1])[::-1]
+        keep = np.ones(len(values), dtype=bool)
+        keep[:-1] = values[:-1] > later[1:]
+        while self.maxima and self.maxima[-1][1] <= later[0]:
+            self.maxima.pop()
+        self.maxima.extend(zip(ts[keep].tolist(), values[keep].tolist()))
+        self.count += len(values)
+        if self.count >= RESYNC: # Avoid drift of the running sum
+            self.count = 0
+            self.total = sum(v for (t, v) in self.samples)
+        self.expire(float(ts[-1]))
+
+    def expire(self, now):
+        limit = now - self.span
+        while self.samples and self.samples[0][0] <= limit:
+            self.total -= self.samples.popleft()[1]
+        while self.maxima and self.maxima[0][0] <= limit:
+            self.maxima.popleft()
+        if not self.samples:
+            self.total = 0.0
+
+    def last(self):
+        return self.samples[-1][1] if self.samples else None
+
+    def values(self):
+        return [sample[1] for sample in self.samples]
+
+    def mean(self):
+        if not self.samples:
+            return -9999
+        # Rounded sum: same mean after add() and extend() (different summation order)
+        return round(self.total, 9) / len(self.samples)
+
+    def max(self):
+        if not self.maxima:
+            return -9999
+        return self.maxima[0][1]
+
+class DirectionWindow:
+    """Vector average of wind directions (degrees) not older than span seconds."""
+    # https://www.dwd.de/DE/leistungen/lf_11_flugwetterbetriebsdienste/handbuch_band_tech_v4.0.pdf
+
+    def __init__(self, span):
+        self.span = float(span)
+        self.samples = deque()                            # (ts, direction, sin, cos)
+        self.sinsum = 0.0
+        self.cossum = 0.0
+        self.count = 0
+
+    def __len__(self):
+        return len(self.samples)
+
+    def add(self, ts, direction):
+        direction = float(direction)
+        s = sin(radians(direction))
+        c = cos(radians(direction))
+        self.samples.append((ts, direction, s, c))
+        self.sinsum += s
+        self.cossum += c
+        self.count += 1
+        if self.count >= RESYNC: # Avoid drift of the running sums
+            self.count = 0
+            self.sinsum = sum(sample[2] for sample in self.samples)
+            self.cossum = sum(sample[3] for sample in self.samples)
+        self.expire(ts)
+
+    def extend(self, ts, directions):
+        """Add a batch of directions (ordered by ts), same result as add() for each."""
+        directions = np.asarray(directions, dtype=float)
+        if not len(directions):
+            return
+        ts = np.asarray(ts, dtype=float)
+        s = np.sin(np.radians(directions))
+        c = np.cos(np.radians(directions))
+        self.samples.extend(zip(ts.tolist(), directions.tolist(), s.tolist(), c.tolist()))
+        self.sinsum += float(s.sum())
+        self.cossum += float(c.sum())
+        self.count += len(directions)
+        if self.count >= RESYNC: # Avoid drift of the running sums
+            self.count = 0
+            self.sinsum = sum(sample[2] for sample in self.samples)
+            self.cossum = sum(sample[3] for sample in self.samples)
+        self.expire(float(ts[-1]))
+
+    def expire(self, now):
+        limit = now - self.span
+        while self.samples and self.samples[0][0] <= limit:
+            (t, d, s, c) = self.samples.popleft()
+            self.sinsum -= s
+            self.cossum -= c
+        if not self.samples:
+            self.sinsum = self.cossum = 0.0
+
+    def last(self):
+        return self.samples[-1][1] if self.samples else None
+
+    def newest(self):                                     # ts of the last sample
+        return self.samples[-1][0] if self.samples else None
+
+    def values(self):
+        return [sample[1] for sample in self.samples]
+
+    def mean(self):
+        if not self.samples:
+            return -9999
+        # Rounded sums: same mean after add() and extend(), opposite directions cancel to 0
+        x = round(self.sinsum, 9) + 0.0                   # + 0.0: no -0.0
+        y = round(self.cossum, 9) + 0.0
+        return round(degrees(atan2(x, y)) % 360,1) % 360  # -0.01 rounds to 0.0, not 360.0
@@ -0,0 +1,436 @@
+# -*- coding: utf-8 -*-
+# Sensor converters and topic dispatch
+
+import json
+import math
+import logging
+import datetime
+
+import paho.mqtt.client as mqtt
+
+from w4lgateway.derived import derive
+
+log = logging.getLogger()
+
+#############################################################################
+# Unit conversions
+#############################################################################
+
+def ctof(c,n):                                           # convert Celsius to Fahrenheit
+    out = "-9999"
+    try:
+        out = round((float(c)*9/5.0) + 32,n)
+    except ValueError: pass
+    return out
+
+def hpatoin(f,n):                                        # convert HPa to inHg
+    return round(float(f)/33.87,n)
+
+def mstomph(m,n):                                        # convert ms to mph
+    return round(float(m)*2.23694,n)
+
+def intomm(f,n):                                         # convert in to mm
+    return round(float(f)/0.0393701,n)
+
+def mmtoin(f,n):                                         # convert mm to in
+    return round(float(f)/25.4,n)
+
+def jsonpath(path):                                      # "$.a.b.0" -> ('a', 'b', 0)
+    keys = list()
+    for key in path.strip().lstrip("$").strip(".").split("."):
+        keys.append(int(key) if key.isdigit() else key)
+    return tuple(keys)
+
+def decodejson(payload):                                 # Parse a JSON payload once for all its sensors
+    return json.loads(payload.decode("utf-8"))
+
+def jsonvalue(document, path):                           # Value at a jsonpath(), None if it is missing
+    value = document
+    for key in path:
+        try:
+            value = value[key]
+        except (KeyError, IndexError, TypeError):
+            return None
+    return value
+
+def parsetime(value):                                    # Epoch (s or ms) or ISO 8601 time -> epoch
+    if isinstance(value, bytes):
+        value = value.decode("utf-8")
+    try:
+        ts = float(value)
+    except ValueError:
+        ts = datetime.datetime.fromisoformat(str(value).strip().replace("Z", "+00:00")).timestamp() # No zone: local time
+    if not math.isfinite(ts): # "nan" / "inf" parse as floats
+        raise ValueError("Time %r is not finite" % value)
+    if ts > 100000000000: # Milliseconds
+        ts = ts / 1000.0
+    return ts
+
+def cfgfloat(config, key, default=None):                 # Parse a numeric config value once
+    try:
+        return float(config[key])
+    except (KeyError, TypeError, ValueError):
+        return default
+
+#############################################################################
+# Sensor converters
+#############################################################################
+
+class Sensor:
+    """Parsed config of one sensor. convert() returns the values 1..n.
+
+    ingest tells how a batch of queued messages is handled: "each" converts
+    every message in order (counters, accumulating sensors), "latest" only
+    the newest one (state-like sensors) and "batch" calls convertbatch()
+    once for all of them.
+
+    With JSON=<path> (e.g. StatusSNS.BME280.Temperature) the payload is a
+    JSON document; the value at path is passed to convert() like a bare
+    payload, so several sensors can share one topic.
+    """
+
+    ingest = "each"
+
+    def __init__(self, item, config, station):
+        self.item = item
+        self.config = config
+        self.station = station
+        self.topic = str(config.get('topic', ''))
+        self.jsonpath = jsonpath(config['json']) if config.get('json') else None
+        # Output names: nameN -> value N of the converted measurement
+        self.names = dict()
+        for key in config:
+            if key.startswith('name') and key[4:].isdigit() and config[key]:
+                self.names[key[4:]] = str(config[key])
+
+    def convert(self, payload, ts):
+        return dict()
+
+    def extract(self, document):
+        """Value at jsonpath as payload (bytes), None if it is missing."""
+        value = jsonvalue(document, self.jsonpath)
+        if value is None:
+            return None
+        if isinstance(value, bool): # Like the ON/OFF of Tasmota
+            value = "ON" if value else "OFF"
+        return str(value).encode("utf-8")
+
+    def convertbatch(self, batch):                       # [(payload, ts)] -> values after the last one
+        ret = dict()
+        for (payload, ts) in batch:
+            ret = self.convert(payload, ts)
+        return ret
+
+class TempSensor(Sensor):
+    ingest = "latest"
+
+    def convert(self, payload, ts):
+        return {'1': ctof(float(payload),1)}
+
+class HumiditySensor(Sensor):
+    ingest = "latest"
+
+    def convert(self, payload, ts):
+        return {'1': round(float(payload),1)}
+
+class PressureSensor(Sensor):
+    ingest = "latest"
+
+    def __init__(self, item, config, station):
+        super().__init__(item, config, station)
+        # Calculate relative pressure: https://www.bjoerns-techblog.de/2017/12/luftdruck-absolut-oder-relativ/
+        # https://www.wetterstationsforum.info/viewtopic.php?t=171#p1443
+        height = cfgfloat(config, 'height', 0)
+        self.correction = 0
+        if height > 880:
+            self.correction = height / 11
+        elif height > 0:
+            self.correction = height / 8
+
+    def convert(self, payload, ts):
+        value = float(payload)
+        return {'1': hpatoin(value,3), '2': hpatoin(value + self.correction,3)}
+
+class IlluminanceSensor(Sensor):
+    ingest = "latest"
+
+    def __init__(self, item, config, station):
+        super().__init__(item, config, station)
+        self.calc_sr = cfgfloat(config, 'calc_sr', 0) > 0
+
+    def convert(self, payload, ts):
+        ret = {'1': round(float(payload),1)}
+        if self.calc_sr: # Calc SolarRadiation from Lux. 126.7 is the facotor Ecowitt uses
+            ret['2'] = round(ret['1']/126.7,2)    # https://www.extrica.com/article/21667/pdf
+        return ret
+
+class TwilightSensor(Sensor):
+    ingest = "latest"
+
+    def __init__(self, item, config, station):
+        super().__init__(item, config, station)
+        self.max = cfgfloat(config, 'max', 0)
+
+    def convert(self, payload, ts):
+        ret = {'1': -9999}
+        if self.max > 0:
+            ret['1'] = round( float(payload) / self.max * 100,1)
+        return ret
+
+class UvSensor(Sensor):
+    ingest = "latest"
+
+    def convert(self, payload, ts):
+        return {'1': round(float(payload) / 0.1,1)}
+
+class WindspeedSensor(Sensor):
+    ingest = "batch"
+
+    def convert(self, payload, ts):
+        s = self.station
+        wind = mstomph(float(payload),2)
+        s.windspeed_avg2m.add(ts, wind)
+        s.windspeed_avg10m.add(ts, wind)
+        return self.values(wind)
+
+    def convertbatch(self, batch):
+        s = self.station
+        winds = [mstomph(float(payload),2) for (payload, ts) in batch]
+        times = [ts for (payload, ts) in batch]
+        s.windspeed_avg2m.extend(times, winds)
+        s.windspeed_avg10m.extend(times, winds)
+        return self.values(winds[-1])
+
+    def values(self, wind):
+        s = self.station
+        return {'1': wind,
+                '2': s.windspeed_avg2m.max(),
+                '3': round(s.windspeed_avg2m.mean(),2),
+                '4': round(s.windspeed_avg10m.mean(),2)}
+
+class WinddirSensor(Sensor):
+    ingest = "batch"
+
+    def __init__(self, item, config, station):
+        super().__init__(item, config, station)
+        # Converttable: voltage -> degrees, either a dict or "VOLT:DEG,VOLT:DEG,..."
+        table = config.get('converttable', {})
+        if isinstance(table, str):
+            table = dict(pair.split(':', 1) for pair in table.split(',') if ':' in pair)
+        self.converttable = dict()
+        for volt in table:
+            self.converttable[str(round(float(volt),1))] = float(table[volt])
+
+    def convert(self, payload, ts):
+        s = self.station
+        volt = round( float(payload),1 )
+        ret = dict()
+        if str(volt) in self.converttable:
+            ret['1'] = self.converttable[str(volt)]
+            s.winddir_avg2m.add(ts, ret['1'])
+            s.winddir_avg10m.add(ts, ret['1'])
+        else:
+            ret['1'] = -9999
+            if len(s.winddir_avg10m) > 0 and len(s.winddir_avg2m) > 0: # Repeat last known direction
+                s.winddir_avg2m.add(ts, s.winddir_avg2m.last())
+                s.winddir_avg10m.add(ts, s.winddir_avg10m.last())
+        s.winddir_avg2m.expire(ts)
+        s.winddir_avg10m.expire(ts)
+        ret['2'] = s.winddir_avg2m.mean()
+        ret['3'] = s.winddir_avg10m.mean()
+        return ret
+
+    def convertbatch(self, batch):
+        s = self.station
+        last = s.winddir_avg2m.last() if len(s.winddir_avg10m) > 0 and len(s.winddir_avg2m) > 0 else None
+        newest = s.winddir_avg2m.newest()
+        previous = None
+        times = list()
+        directions = list()
+        for (payload, ts) in batch:
+            if previous is not None and newest is not None and newest <= previous - s.winddir_avg2m.span:
+                last = None # Window ran empty in a gap, as convert() would see it
+            volt = str(round( float(payload),1 ))
+            direction = self.converttable.get(volt, -9999)
+            if volt in self.converttable:
+                last = direction
+            if last is not None: # Unknown voltage: repeat last known direction
+                times.append(ts)
+                directions.append(last)
+                newest = ts
+            previous = ts
+        s.winddir_avg2m.extend(times, directions)
+        s.winddir_avg10m.extend(times, directions)
+        s.winddir_avg2m.expire(batch[-1][1])
+        s.winddir_avg10m.expire(batch[-1][1])
+        return {'1': direction, '2': s.winddir_avg2m.mean(), '3': s.winddir_avg10m.mean()}
+
+class SolarradiationSensor(Sensor):
+    ingest = "latest"
+
+    def __init__(self, item, config, station):
+        super().__init__(item, config, station)
+        self.offset = cfgfloat(config, 'offset', 0)
+        self.max = cfgfloat(config, 'max', 0)
+
+    def convert(self, payload, ts):
+        value = float(payload) - self.offset
+        if value < 0:
+            value = 0
+        ret = {'1': "-9999"}
+        if self.max > 0:
+            sr = round( (value * 1000) / self.max * 1000,1)
+            if sr < 0.6:
+                ret['1'] = 0
+            else:
+                ret['1'] = sr
+        return ret
+
+class RainstateSensor(Sensor):
+    def convert(self, payload, ts):
+        if payload.decode("utf-8") == "ON":
+            return {'1': 1, 'cur_state': 1}
+        return {'1': 0, 'cur_state': 0}
+
+class RainrateSensor(Sensor):
+    def __init__(self, item, config, station):
+        super().__init__(item, config, station)
+        self.calc_rr = cfgfloat(station.sensors.get('rainstate', {}), 'calc_rr', 0) > 0
+
+    def convert(self, payload, ts):
+        s = self.station
+        value = float(payload)
+        rainrate = mmtoin(value * 6,3) # Rate is mm/10m, so factor 6 for mm/hr
+        amount = mmtoin(value,3) # Amount in the last 10 minutes
+        if self.calc_rr and float(s.data.get('rainstate', {}).get('cur_state', 0)) > 0 and rainrate < 0.5: # Calculate rainrate from rainstate
+            rainrate = mmtoin(float(0.5),3) # 0.5 mm/hr
+            amount = mmtoin(float(0.083),3) # 0.5mm/h, Amount in the last 10 minutes
+        ret = s.addhistory('rain', ts, amount, rainrate >= 0.03937) # Rain Event, https://www.wetterstationsforum.info/viewtopic.php?t=241
+        ret['1'] = rainrate
+        for val in ret:
+            ret[val] = float(ret[val])
+        return ret
+
+class LightningLastSensor(Sensor):
+    ingest = "latest"
+
+    def convert(self, payload, ts):
+        try:
+            x = datetime.datetime.utcfromtimestamp(float(payload)) # Convert to UTC
+            last =  int(x.timestamp())
+            if last < 0:
+                last = 0
+            return {'1': str( last )}
+        except:
+            return {'1': 0}
+
+class LightningDistanceSensor(Sensor):
+    ingest = "latest"
+
+    def convert(self, payload, ts):
+        return {'1': round(float(payload),1)}
+
+class LightningNumberSensor(Sensor):
+    def convert(self, payload, ts):
+        history = self.station.historydata['lightning']
+        number = float(payload)
+        if number < int(history['offset']): # Seems plugin was restarted
+            history['offset'] = 0
+        amount = number - int(history['offset'])
+        history['offset'] = number
+        ret = self.station.addhistory('lightning', ts, amount)
+        ret['1'] = number
+        for val in ret:
+            ret[val] = int(ret[val])
+        return ret
+
+class DerivedSensor(Sensor):
+    """Dew point, heat index, wind chill and feels-like (values 1..4).
+
+    Has no topic: the station calls update() after temp, humidity or
+    windspeed were converted, and the values are only recomputed if one
+    of the inputs changed.
+    """
+
+    inputs = ('temp', 'humidity', 'windspeed')
+
+    def __init__(self, item, config, station):
+        super().__init__(item, config, station)
+        self.last = None
+
+    def input(self, item):                               # Latest value 1 of an input sensor
+        try:
+            value = float(self.station.data[item]['1'])
+        except (KeyError, TypeError, ValueError):
+            return None
+        return None if value == -9999 else value
+
+    def update(self):
+        """New values, or None if no input changed (or there is no temp)."""
+        values = tuple(self.input(item) for item in self.inputs)
+        if values[0] is None or values == self.last:
+            return None
+        self.last = values
+        ret = dict()
+        derived = derive(*values)
+        for val in derived:
+            ret[val] = round(float(derived[val]),1)
+        return ret
+
+sensortypes = {
+    'temp': TempSensor,
+    'humidity': HumiditySensor,
+    'pressure': PressureSensor,
+    'illuminance': IlluminanceSensor,
+    'twilight': TwilightSensor,
+    'uv': UvSensor,
+    'windspeed': WindspeedSensor,
+    'winddir': WinddirSensor,
+    'solarradiation': SolarradiationSensor,
+    'rainstate': RainstateSensor,
+    'rainrate': RainrateSensor,
+    'lightning_last': LightningLastSensor,
+    'lightning_distance': LightningDistanceSensor,
+    'lightning_number': LightningNumberSensor,
+    'derived': DerivedSensor,
+}
+
+#############################################################################
+# Topic dispatch
+#############################################################################
+
+class TopicIndex:
+    """Map MQTT topics to sensor converters (exact topics and +/# wildcards)."""
+
+    def __init__(self):
+        self.exact = dict()
+        self.wildcards = list()
+
+    def add(self, topic, sensor):
+        if '+' in topic or '#' in topic:
+            self.wildcards.append((topic, sensor))
+        else:
+            self.exact.setdefault(topic, []).append(sensor)
+
+    def lookup(self, topic):
+        found = self.exact.get(topic, [])
+        if self.wildcards:
+            found = found + [sensor for (sub, sensor) in self.wildcards if mqtt.topic_matches_sub(sub, topic)]
+        return found
+
+def buildtopics(station, basetopic):                     # Build the topic index from the sensor config
+    index = TopicIndex()
+    for item in station.sensors:
+        if item not in sensortypes:
+            log.warning("Unknown sensor type %s in configuration. Ignoring.", item)
+            continue
+        if not station.sensors[item].get('topic'):
+            continue
+        sensor = sensortypes[item](item, station.sensors[item], station)
+        # Topics not below the subscribed base topic are relative to it
+        topic = sensor.topic
+        if topic != basetopic and not topic.startswith(basetopic + "/"):
+            topic = basetopic + "/" + topic.lstrip("/")
+        log.info("Sensor %s listens on topic %s", item, topic)
+        index.add(topic, sensor)
+    return index
@@ -0,0 +1,295 @@
+# -*- coding: utf-8 -*-
+# Output sinks of the gateway
+
+import time
+import socket
+import logging
+import datetime
+import threading
+
+import requests
+
+from w4lgateway.metrics import Histogram, LATENCYBUCKETS
+
+log = logging.getLogger()
+
+class Sink:
+    """Send snapshots of the current values to one destination.
+
+    Every sink has its own background thread and rate limit (interval), so
+    a slow destination never delays the others. Only the most recent
+    snapshot is kept: a new snapshot replaces one that is still waiting
+    (or waiting for a retry), so a slow or unreachable destination never
+    builds up a backlog of stale data. Failed sends are retried with
+    exponential backoff.
+    """
+
+    name = "sink"
+
+    def __init__(self, interval, retries=5, backoff=2, maxbackoff=300, deadband=None):
+        self.interval = float(interval)
+        self.deadband = deadband                          # Only send changed values
+        self.retries = int(retries)
+        self.backoff = float(backoff)
+        self.maxbackoff = float(maxbackoff)
+        self.cond = threading.Condition()
+        self.pending = None
+        self.attempt = 0
+        self.retryat = 0
+        self.lastsubmit = 0
+        self.running = False
+        self.thread = None
+        self.stats = {'submitted': 0, 'sent': 0, 'failed': 0, 'retries': 0, 'superseded': 0,
+                      'errors': 0, 'latency': 0.0, 'latency_max': 0.0, 'latency_sum': 0.0}
+        self.latency = Histogram(LATENCYBUCKETS)
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name=self.name, daemon=True)
+        self.thread.start()
+
+    def deadline(self):
+        return self.lastsubmit + self.interval
+
+    def submit(self, snapshot, now=None):
+        with self.cond:
+            self.lastsubmit = time.time() if now is None else now
+            if self.deadband is not None:
+                snapshot = self.deadband.select(snapshot, self.lastsubmit)
+                if not snapshot:
+                    return
+                if self.pending is not None: # Changes not sent yet are still due
+                    snapshot = dict(self.pending, **snapshot)
+            if self.pending is not None:
+                self.stats['superseded'] += 1
+            self.pending = dict(snapshot)
+            self.attempt = 0
+            self.retryat = 0
+            self.stats['submitted'] += 1
+            self.cond.notify()
+
+    def stop(self, timeout=5):
+        """Stop the sender. A pending snapshot gets one last try."""
+        with self.cond:
+            self.running = False
+            self.retryat = 0
+            self.cond.notify()
+        if self.thread is not None:
+            self.thread.join(timeout)
+        self.close()
+
+    def close(self):
+        pass
+
+    def run(self):
+        while True:
+            with self.cond:
+                while self.running and (self.pending is None or time.time() < self.retryat):
+                    if self.pending is None:
+                        self.cond.wait()
+                    else:
+                        self.cond.wait(self.retryat - time.time())
+                if self.pending is None:
+                    return
+                snapshot = self.pending
+                attempt = self.attempt
+                running = self.running
+            ok = self.timedsend(snapshot)
+            with self.cond:
+                self.finish(snapshot, attempt, running, ok)
+                if not running:
+                    return
+
+    def finish(self, snapshot, attempt, running, ok):     # Retry or drop a sent snapshot
+        if self.pending is snapshot: # Not replaced in the meantime
+            if ok or attempt >= self.retries or not running:
+                if not ok:
+                    self.stats['failed'] += 1
+                    log.error("Giving up sending data to %s after %d attempts.", self.name, attempt + 1)
+                self.pending = None
+            else:
+                self.stats['retries'] += 1
+                self.attempt = attempt + 1
+                self.retryat = time.time() + min(self.backoff * 2 ** attempt, self.maxbackoff)
+
+    def timedsend(self, snapshot):
+        start = time.time()
+        try:
+            ok = self.send(snapshot)
+        except Exception as e:
+            log.critical("Cannot send data to %s! Error: %s", self.name, e)
+            ok = False
+        self.record(ok, time.time() - start)
+        return ok
+
+    def record(self, ok, latency):                        # Statistics of one send
+        if ok:
+            self.stats['sent'] += 1
+            self.stats['latency'] = latency
+            self.stats['latency_sum'] += latency
+            self.stats['latency_max'] = max(self.stats['latency_max'], latency)
+            self.latency.observe(latency)
+        else:
+            self.stats['errors'] += 1
+        return ok
+
+    def send(self, snapshot):
+        raise NotImplementedError
+
+class Deadband:
+    """Select the values that changed by more than their deadband.
+
+    bands maps an output name to (deadband, maxage). A deadband is an
+    absolute value ("0.5") or relative to the last sent value ("2%"),
+    without deadband every change is sent. A value is sent anyway if it
+    was not sent for maxage seconds (heartbeat).
+    """
+
+    def __init__(self, bands=None, maxage=300):
+        self.maxage = float(maxage)
+        self.bands = dict()
+        for name in bands or {}:
+            (band, age) = bands[name]
+            absolute = relative = 0.0
+            band = str(band or "").strip()
+            if band.endswith('%'):
+                relative = float(band[:-1]) / 100
+            elif band:
+                absolute = float(band)
+            self.bands[name] = (absolute, relative, float(age) if age else self.maxage)
+        self.last = dict()                                # name -> (value, ts)
+
+    def select(self, snapshot, now):
+        ret = dict()
+        for name in snapshot:
+            value = snapshot[name]
+            (absolute, relative, maxage) = self.bands.get(name, (0.0, 0.0, self.maxage))
+            last = self.last.get(name)
+            if last is None or now - last[1] >= maxage or self.exceeds(last[0], value, absolute, relative):
+                ret[name] = value
+                self.last[name] = (value, now)
+        return ret
+
+    def exceeds(self, old, new, absolute, relative):
+        try:
+            diff = abs(float(new) - float(old))
+        except (TypeError, ValueError):
+            return str(new) != str(old)
+        if diff == 0:
+            return False
+        return diff >= max(absolute, abs(float(old)) * relative)
+
+class EcowittSink(Sink):
+    """POST to an Ecowitt compatible server over a keep-alive session."""
+
+    name = "Ecowitt server"
+
+    def __init__(self, url, interval, connecttimeout=3, readtimeout=10, **kwargs):
+        super().__init__(interval, **kwargs)
+        self.url = url
+        self.timeout = (float(connecttimeout), float(readtimeout))
+        self.session = requests.Session()
+
+    def send(self, snapshot):
+        data = dict(snapshot)
+        data.setdefault('dateutc', datetime.datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S"))
+        try:
+            response = self.session.post(self.url, data=data, timeout=self.timeout)
+            response.raise_for_status()
+        except requests.exceptions.RequestException as e:
+            log.critical("Cannot send data to Ecowitt server! Error: %s", e)
+            return False
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("Response from Server: %s", response.text)
+        return True
+
+    def close(self):
+        self.session.close()
+
+class MqttSink(Sink):
+    """Republish converted values as retained MQTT messages <topic>/<name>."""
+
+    name = "MQTT"
+
+    def __init__(self, client, topic, interval, **kwargs):
+        super().__init__(interval, **kwargs)
+        self.client = client
+        self.topic = topic.rstrip("/")
+
+    def send(self, snapshot):
+        ok = True
+        for name in snapshot:
+            info = self.client.publish(self.topic + "/" + name, str(snapshot[name]), qos=0, retain=True)
+            if info.rc != 0:
+                ok = False
+        return ok
+
+class LoxoneUdpSink(Sink):
+    """Send name=value pairs to a Loxone virtual UDP input."""
+
+    name = "Loxone UDP"
+    MAXSIZE = 220                                         # Max. size of one datagram
+
+    def __init__(self, host, port, interval, prefix="", **kwargs):
+        super().__init__(interval, **kwargs)
+        self.address = (host, int(port))
+        self.prefix = prefix
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def send(self, snapshot):
+        packets = list()
+        packet = ""
+        for name in snapshot:
+            item = "%s%s=%s" % (self.prefix, name, snapshot[name])
+            if packet and len(packet) + 1 + len(item) > self.MAXSIZE:
+                packets.append(packet)
+                packet = ""
+            packet = packet + " " + item if packet else item
+        if packet:
+            packets.append(packet)
+        for packet in packets:
+            self.sock.sendto(packet.encode("utf-8"), self.address)
+        return True
+
+    def close(self):
+        self.sock.close()
+
+class Pipeline:
+    """Fan out the same snapshot to all sinks, each at its own interval."""
+
+    def __init__(self):
+        self.sinks = list()
+
+    def __len__(self):
+        return len(self.sinks)
+
+    def add(self, sink):
+        self.sinks.append(sink)
+        sink.start()
+
+    def deadline(self):
+        return min([sink.deadline() for sink in self.sinks] or [float('inf')])
+
+    def publish(self, now, snapshot, force=False):
+        """Submit the snapshot to all sinks whose interval passed (force: to all, e.g. on shutdown)."""
+        for sink in self.sinks:
+            if force or now >= sink.deadline():
+                sink.submit(snapshot, now)
+
+    def samples(self, labels=()):                         # Sink statistics for the metrics
+        ret = list()
+        prefix = labels
+        for sink in self.sinks:
+            labels = prefix + (('sink', sink.name),)
+            for key in ('submitted', 'sent', 'failed', 'retries', 'superseded', 'errors'):
+                ret.append(('w4l_sink_' + key + '_total', labels, sink.stats[key]))
+            ret.append(('w4l_sink_pending', labels, 0 if sink.pending is None else 1))
+            for (le, count) in sink.latency.cumulative():
+                ret.append(('w4l_sink_latency_seconds_bucket', labels + (('le', '+Inf' if le == float('inf') else repr(le)),), count))
+            ret.append(('w4l_sink_latency_seconds_sum', labels, sink.latency.sum))
+            ret.append(('w4l_sink_latency_seconds_count', labels, sink.latency.count))
+        return ret
+
+    def stop(self):
+        for sink in self.sinks:
+            sink.stop()
@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+# Memory mapped snapshot of the current values for local readers
+#
+# Layout (little endian) see data/snapshot.format.
+
+import os
+import math
+import mmap
+import time
+import zlib
+import struct
+import logging
+
+log = logging.getLogger()
+
+MAGIC = b"W4LSNAP\0"
+LAYOUT = 2
+HEADER = struct.Struct('<8sIIQdI')                        # magic, layout, slots, seq, updated, used
+HEADERSIZE = 64
+SEQ = struct.Struct('<Q')                                 # at offset 16, odd while being written
+SEQOFFSET = 16
+STAMP = struct.Struct('<dI')                              # updated, used at offset 24
+STAMPOFFSET = 24
+CRC = struct.Struct('<I')                                 # at offset 36: CRC-32 of bytes 24-35 and the used slots
+CRCOFFSET = 36
+SLOT = struct.Struct('<48sdd')                            # name, value, ts
+SLOTSIZE = 64
+VALUE = struct.Struct('<dd')                              # value, ts at offset 48 of a slot
+VALUEOFFSET = 48
+
+def checksum(data, used):                                 # CRC-32 of updated, used and the used slots
+    crc = zlib.crc32(data[STAMPOFFSET:CRCOFFSET])
+    return zlib.crc32(data[HEADERSIZE:HEADERSIZE + used * SLOTSIZE], crc)
+
+class SnapshotFile:
+    """Writer of the snapshot file, one slot per output name.
+
+    Every update() changes the values in place, framed by the sequence
+    counter: it is odd while a write is in progress and incremented to the
+    next even number when the write is done. Readers copy the file and
+    retry if the counter was odd or changed meanwhile (seqlock), so they
+    never lock. mmap writes have no memory barrier, on ARM a reader may see
+    the counter and the slots out of order; the CRC-32 of the payload,
+    written last, is checked as well, so a half written snapshot is never
+    used. Names get a slot on their first value and keep it until the
+    gateway restarts or rebuild() drops them.
+    """
+
+    def __init__(self, path, slots=256):
+        self.path = path
+        self.slots = int(slots)
+        self.index = dict()                               # name -> slot
+        self.seq = 0
+        self.updated = 0.0
+        self.full = False
+        size = HEADERSIZE + self.slots * SLOTSIZE
+        # Replace an old file atomically, readers holding it keep their mapping
+        tmp = path + ".tmp"
+        with open(tmp, 'wb') as f:
+            f.write(bytes(size))
+            f.seek(0)
+            f.write(HEADER.pack(MAGIC, LAYOUT, self.slots, 0, 0.0, 0))
+            f.seek(CRCOFFSET)
+            f.write(CRC.pack(zlib.crc32(STAMP.pack(0.0, 0))))
+        os.replace(tmp, path)
+        self.file = open(path, 'r+b')
+        self.map = mmap.mmap(self.file.fileno(), size)
+
+    def slot(self, name):
+        if len(self.index) >= self.slots:
+            if not self.full:
+                log.warning("Snapshot %s is full (%d names), %s and later names are missing.", self.path, self.slots, name)
+                self.full = True
+            return None
+        slot = len(self.index)
+        self.index[name] = slot
+        SLOT.pack_into(self.map, HEADERSIZE + slot * SLOTSIZE, name.encode("utf-8")[:47], math.nan, 0.0)
+        return slot
+
+    def update(self, ts, values):
+        """Write the {name: value} of one batch (non numeric values as NaN)."""
+        self.seq += 1
+        SEQ.pack_into(self.map, SEQOFFSET, self.seq)
+        for name in values:
+            slot = self.index.get(name)
+            if slot is None:
+                slot = self.slot(name)
+                if slot is None:
+                    continue
+            try:
+                value = float(values[name])
+            except (TypeError, ValueError):
+                value = math.nan
+            VALUE.pack_into(self.map, HEADERSIZE + slot * SLOTSIZE + VALUEOFFSET, value, ts)
+        self.updated = ts
+        self.commit()
+
+    def commit(self):                                     # Stamp, checksum and end the write
+        STAMP.pack_into(self.map, STAMPOFFSET, self.updated, len(self.index))
+        CRC.pack_into(self.map, CRCOFFSET, checksum(self.map, len(self.index)))
+        self.seq += 1
+        SEQ.pack_into(self.map, SEQOFFSET, self.seq)
+
+    def rebuild(self, names):
+        """Keep the slots of names only (e.g. after a config reload), compacted."""
+        keep = [name for name in sorted(self.index, key=self.index.get) if name in names]
+        if len(keep) == len(self.index):
+            return
+        slots = [self.map[HEADERSIZE + self.index[name] * SLOTSIZE:HEADERSIZE + (self.index[name] + 1) * SLOTSIZE] for name in keep]
+        self.seq += 1
+        SEQ.pack_into(self.map, SEQOFFSET, self.seq)
+        self.map[HEADERSIZE:HEADERSIZE + len(self.index) * SLOTSIZE] = bytes(len(self.index) * SLOTSIZE)
+        for (slot, data) in enumerate(slots):
+            self.map[HEADERSIZE + slot * SLOTSIZE:HEADERSIZE + (slot + 1) * SLOTSIZE] = data
+        self.index = dict((name, slot) for (slot, name) in enumerate(keep))
+        self.full = False
+        self.commit()
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+class SnapshotReader:
+    """Lock free reader of a snapshot file.
+
+    read() returns (updated, {name: (value, ts)}). A new file written by a
+    restarted gateway is picked up automatically.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+        self.map = None
+        self.inode = None
+        self.slots = 0
+
+    def open(self):
+        st = os.stat(self.path)
+        if self.map is not None and st.st_ino == self.inode:
+            return
+        self.close()
+        self.file = open(self.path, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.inode = st.st_ino
+        (magic, layout, self.slots, seq, updated, used) = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC or layout != LAYOUT:
+            self.close()
+            raise ValueError("%s is no snapshot file of layout %d" % (self.path, LAYOUT))
+
+    def read(self, retries=1000):
+        self.open()
+        for attempt in range(retries):
+            seq = SEQ.unpack_from(self.map, SEQOFFSET)[0]
+            if seq % 2 == 0:
+                data = self.map[:]
+                (updated, used) = STAMP.unpack_from(data, STAMPOFFSET)
+                if (SEQ.unpack_from(self.map, SEQOFFSET)[0] == seq and used <= self.slots
+                        and CRC.unpack_from(data, CRCOFFSET)[0] == checksum(data, used)):
+                    values = dict()
+                    for (name, value, ts) in SLOT.iter_unpack(data[HEADERSIZE:HEADERSIZE + used * SLOTSIZE]):
+                        values[name.rstrip(b"\0").decode("utf-8", "replace")] = (value, ts)
+                    return (updated, values)
+            time.sleep(0)
+        raise TimeoutError("Snapshot %s is being written all the time" % self.path)
+
+    def get(self, name, default=None):                   # Current value of one name
+        return self.read()[1].get(name, (default, 0))[0]
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.file.close()
+        self.map = self.file = self.inode = None
+        self.slots = 0
@@ -0,0 +1,303 @@
+# -*- coding: utf-8 -*-
+# Message processing core of the gateway
+
+import time
+import logging
+import datetime
+
+from w4lgateway.rolling import RollingWindow, DirectionWindow
+from w4lgateway.stats import Accumulator
+from w4lgateway.sensors import TopicIndex, DerivedSensor, buildtopics, decodejson
+
+log = logging.getLogger()
+
+class Station:
+    """Sensor converters and their state (wind windows, rain / lightning history).
+
+    The station has no side effects besides its optional HistoryStore, so it
+    can be fed from the MQTT client as well as from recorded messages with a
+    fake clock. One gateway process can host several stations, each below
+    its own base topic with its own settings, history file and sinks.
+    """
+
+    def __init__(self, name="main", config=None):
+        self.name = name
+        self.config = config or dict()                    # Gateway settings of this station
+        self.topic = ""                                   # Base topic
+        self.sinks = None                                 # Output Pipeline, set up by the gateway
+        self.sensors = dict()
+        self.topics = TopicIndex()
+        self.derived = None                               # Optional DerivedSensor
+        self.sensorvalues = dict()
+        self.data = dict()
+        self.windspeed_avg2m = RollingWindow(120)
+        self.windspeed_avg10m = RollingWindow(600)
+        self.winddir_avg2m = DirectionWindow(120)
+        self.winddir_avg10m = DirectionWindow(600)
+        self.historydata = dict()
+        self.store = None
+        self.series = None                                # Optional TimeSeriesStore of the outputs
+        self.snapshot = None                              # Optional SnapshotFile of the current values
+        self.rainstats = None
+        self.lightningstats = None
+        self.timings = None                               # item -> list of handler times
+        self.metrics = None                               # Optional Metrics registry
+        self.dumpinterval = 60                            # Min. seconds between debug state dumps
+        self.lastdump = 0
+
+    def configure(self, sensors, basetopic):
+        self.swap(sensors, basetopic, self.build(sensors, basetopic))
+
+    def build(self, sensors, basetopic):
+        """Converters and topic index of a sensor config, without using them yet."""
+        current = self.sensors
+        self.sensors = sensors                            # Converters may read the config of other sensors
+        try:
+            topics = buildtopics(self, basetopic)
+            derived = None
+            if 'derived' in sensors:
+                derived = DerivedSensor('derived', sensors['derived'], self)
+        finally:
+            self.sensors = current
+        return (topics, derived)
+
+    def swap(self, sensors, basetopic, built):
+        (self.topics, self.derived) = built
+        if self.series is not None and sensors != self.sensors: # Renamed outputs
+            self.series.mapcolumns(sensors, self.name)
+        self.sensors = sensors
+        self.topic = basetopic
+
+    def reconfigure(self, sensors, basetopic, built):
+        """Switch to a changed sensor config (converters from build()).
+
+        State of unchanged sensors is kept. Sensors that were changed or
+        removed lose their current values and rolling windows, the rain and
+        lightning history is always kept. Returns the changed items.
+        """
+        changed = set(item for item in set(self.sensors) | set(sensors) if self.sensors.get(item) != sensors.get(item))
+        for item in changed:
+            for key in self.sensors.get(item, {}):
+                if key.startswith('name') and key[4:].isdigit():
+                    self.sensorvalues.pop(self.sensors[item][key], None)
+            self.data.pop(item, None)
+        if changed and self.snapshot is not None: # No stale slots of removed outputs
+            self.snapshot.rebuild(self.sensorvalues)
+        if 'windspeed' in changed:
+            self.windspeed_avg2m = RollingWindow(120)
+            self.windspeed_avg10m = RollingWindow(600)
+        if 'winddir' in changed:
+            self.winddir_avg2m = DirectionWindow(120)
+            self.winddir_avg10m = DirectionWindow(600)
+        self.swap(sensors, basetopic, built)
+        return changed
+
+    def loadhistory(self, store=None):
+        """Load history data from store (or start empty) and replay its journal."""
+        self.store = store
+        journal = list()
+        if store is not None:
+            (self.historydata, journal) = store.load()
+        historydata = self.historydata
+        # Set defaults
+        for kind in ('rain', 'lightning'):
+            for period in ('event', 'hourly', 'daily', 'weekly', 'monthly'):
+                historydata.setdefault(kind, {}).setdefault(period, {}).setdefault('amount',0)
+                historydata.setdefault(kind, {}).setdefault(period, {}).setdefault('last',0)
+            historydata.setdefault(kind, {}).setdefault('yearly', {})
+            historydata.setdefault(kind, {}).setdefault('24h', {})
+            historydata.setdefault(kind, {}).setdefault('1h', {})
+        historydata.setdefault('lightning', {}).setdefault('offset',0)
+        # Running totals
+        years = int(self.config.get('historyyears', 0))
+        self.rainstats = Accumulator(historydata['rain'], years=years)
+        self.lightningstats = Accumulator(historydata['lightning'], integer=True, years=years)
+        # Recover increments since the last checkpoint
+        for entry in journal:
+            if 'offset' in entry:
+                historydata['lightning']['offset'] = entry['offset']
+            stats = self.rainstats if entry['kind'] == 'rain' else self.lightningstats
+            stats.expire(datetime.datetime.fromtimestamp(float(entry['ts'])))
+            stats.add(float(entry['ts']), entry['amount'], entry.get('event', False))
+
+    def addhistory(self, kind, ts, amount, event=False):
+        """Add an increment to the history stats."""
+        if self.store is not None and (amount or event): # Zero increments are not journaled (SD card wear)
+            entry = {'kind': kind, 'ts': ts, 'amount': amount}
+            if event:
+                entry['event'] = True
+            if kind == 'lightning':
+                entry['offset'] = self.historydata['lightning']['offset']
+            self.store.append(entry)
+        stats = self.rainstats if kind == 'rain' else self.lightningstats
+        return stats.add(ts, amount, event)
+
+    def process(self, topic, payload, ts, document=None):
+        """Convert a received measurement. Returns the new output values."""
+        return self.processbatch([(topic, payload, ts, document)])
+
+    def processbatch(self, messages):
+        """Convert all [(topic, payload, ts)] received since the last call.
+
+        A message may carry its already decoded JSON payload as fourth
+        element (topic, payload, ts, document), e.g. from the source time.
+
+        Messages of "latest" sensors are coalesced to the newest one,
+        "batch" sensors convert all their messages at once, all others are
+        converted one by one in the order received. Returns the new output
+        values.
+        """
+        debug = log.isEnabledFor(logging.DEBUG)
+        entries = list()
+        for message in messages:
+            (topic, payload, ts) = message[:3]
+            if debug:
+                log.debug("Received subscription: %s Payload: %s", topic, payload.decode("utf-8", "replace"))
+            found = self.topics.lookup(topic)
+            if not found and self.metrics is not None:
+                self.metrics.unmatched(self.name, topic)
+            # Check for new measurement
+            document = message[3] if len(message) > 3 else None
+            for sensor in found:
+                value = payload
+                if sensor.jsonpath is not None: # JSON document: parsed once for all sensors of the topic
+                    if document is None:
+                        try:
+                            document = decodejson(payload)
+                        except ValueError:
+                            log.error("Cannot decode JSON payload of %s: %s", topic, payload.decode("utf-8", "replace"))
+                            document = False
+                    if document is False:
+                        if self.metrics is not None:
+                            self.metrics.inc('w4l_conversion_errors_total', (('station', self.name), ('sensor', sensor.item)))
+                        continue
+                    value = sensor.extract(document)
+                    if value is None:
+                        if debug:
+                            log.debug("No value for %s in JSON payload of %s", sensor.item, topic)
+                        continue
+                if debug:
+                    log.debug("Received Measurement %s (Original): %s %s", sensor.item, topic, value.decode("utf-8", "replace"))
+                entries.append((sensor, value, ts))
+        ret = dict()
+        if len(entries) == 1:
+            (sensor, payload, ts) = entries[0]
+            self.apply(sensor, [(payload, ts)], ret, debug)
+        elif entries:
+            last = dict((entry[0], i) for (i, entry) in enumerate(entries))
+            batches = dict()
+            for (i, (sensor, payload, ts)) in enumerate(entries):
+                if sensor.ingest == "each":
+                    self.apply(sensor, [(payload, ts)], ret, debug)
+                    continue
+                batches.setdefault(sensor, []).append((payload, ts))
+                if last[sensor] == i: # Convert the batch at the position of its newest message
+                    batch = batches.pop(sensor)
+                    if sensor.ingest == "latest" and len(batch) > 1:
+                        if self.metrics is not None:
+                            self.metrics.inc('w4l_coalesced_messages_total', (('station', self.name), ('sensor', sensor.item)), len(batch) - 1)
+                        batch = batch[-1:]
+                    self.apply(sensor, batch, ret, debug)
+        if self.derived is not None and any(entry[0].item in DerivedSensor.inputs for entry in entries):
+            self.derive(ret, debug)
+        if self.series is not None and ret:
+            self.series.add(messages[-1][2], ret)
+        if self.snapshot is not None and ret:
+            self.snapshot.update(messages[-1][2], ret)
+        if debug and messages and self.dumpinterval > 0 and messages[-1][2] >= self.lastdump + self.dumpinterval:
+            self.dumpstate(messages[-1][2])
+        return ret
+
+    def apply(self, sensor, batch, ret, debug):
+        """Convert [(payload, ts)] of one sensor and save the new values in ret."""
+        item = sensor.item
+        start = time.perf_counter()
+        try:
+            if len(batch) == 1:
+                self.data[item] = sensor.convert(batch[0][0], batch[0][1])
+            else:
+                self.data[item] = sensor.convertbatch(batch)
+        except ValueError:
+            if len(batch) > 1: # Skip only the bad payloads
+                for entry in batch:
+                    self.apply(sensor, [entry], ret, debug)
+                return
+            log.error("Cannot convert payload for %s: %s", item, batch[0][0].decode("utf-8", "replace"))
+            if self.metrics is not None:
+                self.metrics.inc('w4l_conversion_errors_total', (('station', self.name), ('sensor', item)))
+            return
+        elapsed = time.perf_counter() - start
+        if self.timings is not None:
+            self.timings.setdefault(item, []).append(elapsed)
+        if self.metrics is not None:
+            self.metrics.message(self.name, item, elapsed, len(batch))
+
+        self.save(sensor, ret, debug)
+
+    def derive(self, ret, debug):
+        """Update the derived quantities if one of their inputs changed."""
+        start = time.perf_counter()
+        values = self.derived.update()
+        if values is None:
+            return
+        elapsed = time.perf_counter() - start
+        if self.timings is not None:
+            self.timings.setdefault('derived', []).append(elapsed)
+        if self.metrics is not None:
+            self.metrics.message(self.name, 'derived', elapsed)
+        self.data['derived'] = values
+        self.save(self.derived, ret, debug)
+
+    def save(self, sensor, ret, debug):
+        """Save the new current data of a sensor under its output names."""
+        item = sensor.item
+        for val in self.data[item]:
+            if val in sensor.names and self.data[item][val] is not None:
+                self.sensorvalues[sensor.names[val]] = self.data[item][val]
+                ret[sensor.names[val]] = self.data[item][val]
+                if debug:
+                    log.debug("Received Measurement %s (Converted): %s %s", item, sensor.names[val], self.data[item][val])
+
+    def dumpstate(self, ts):
+        """Log the full history data and wind buffers (rate limited by dumpinterval)."""
+        self.lastdump = ts
+        log.debug("Stored History Data: %s", self.historydata)
+        log.debug("Stored Windspeed AVG2m Data: %s", self.windspeed_avg2m.values())
+        log.debug("Stored Windspeed AVG10m Data: %s", self.windspeed_avg10m.values())
+        log.debug("Stored Winddir AVG2m Data: %s", self.winddir_avg2m.values())
+        log.debug("Stored Winddir AVG10m Data: %s", self.winddir_avg10m.values())
+
+    def housekeeping(self, now):
+        """Reset / calculate some historical data and checkpoint it."""
+        self.rainstats.expire(now)
+        self.lightningstats.expire(now)
+        if self.store is not None and now.timestamp() >= self.store.deadline():
+            self.store.save(self.historydata)
+        if self.series is not None:
+            self.series.housekeeping(now.timestamp())
+
+    def samples(self):                                    # History sizes for the metrics
+        ret = list()
+        for (kind, stats) in (('rain', self.rainstats), ('lightning', self.lightningstats)):
+            if stats is not None:
+                for period in ('1h', '24h', 'yearly'):
+                    ret.append(('w4l_history_entries', (('station', self.name), ('kind', kind), ('period', period)), len(stats.history[period])))
+        return ret
+
+    def deadline(self):
+        due = min(self.rainstats.deadline(), self.lightningstats.deadline())
+        if self.store is not None:
+            due = min(due, self.store.deadline())
+        if self.series is not None:
+            due = min(due, self.series.deadline())
+        return due
+
+    def close(self):
+        """Write history data."""
+        if self.series is not None:
+            self.series.close()
+        if self.snapshot is not None:
+            self.snapshot.close()
+        if self.store is not None:
+            self.store.save(self.historydata)
+            self.store.close()
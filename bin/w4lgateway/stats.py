@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+# Incremental rain and lightning statistics
+
+import time
+import datetime
+from array import array
+from bisect import bisect_left
+
+class Series:
+    """Time ordered buckets of the last span seconds as numeric arrays.
+
+    Keys are integer epochs (start of the bucket) and increase
+    monotonically, so expiry only cuts the front of both arrays. In
+    history.json (layout 2, see data/history.format) the series is stored
+    as {"ts": [...], "amount": [...]}; {"<float ts>": amount} of layout 1
+    is still read.
+    """
+
+    def __init__(self, span, buckets=None, typecode='d'):
+        self.span = span
+        self.keys = array('q')
+        self.amounts = array(typecode)
+        self.cast = int if typecode == 'q' else float
+        buckets = buckets or {}
+        if 'ts' in buckets: # Current layout
+            pairs = zip(buckets['ts'], buckets['amount'])
+        else: # Layout 1: {"<ts>": amount}
+            pairs = [(key, buckets[key]) for key in buckets]
+        for (ts, amount) in sorted((int(float(ts)), amount) for (ts, amount) in pairs):
+            self.set(ts, amount)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __repr__(self):
+        return repr(self.todict())
+
+    def set(self, ts, amount):
+        """Set the amount of bucket ts and return the previous amount."""
+        amount = self.cast(amount)
+        if not self.keys or ts > self.keys[-1]:
+            self.keys.append(ts)
+            self.amounts.append(amount)
+            return 0
+        # Clock went backwards or a late sample: insert in order
+        i = bisect_left(self.keys, ts)
+        if self.keys[i] == ts:
+            old = self.amounts[i]
+            self.amounts[i] = amount
+            return old
+        self.keys.insert(i, ts)
+        self.amounts.insert(i, amount)
+        return 0
+
+    def expire(self, now):
+        """Drop buckets older than span and return the sum of their amounts."""
+        i = bisect_left(self.keys, now - self.span)
+        if not i:
+            return 0
+        expired = sum(self.amounts[:i])
+        del self.keys[:i]
+        del self.amounts[:i]
+        return expired
+
+    def deadline(self):
+        if not self.keys:
+            return float('inf')
+        return self.keys[0] + self.span
+
+    def values(self):
+        return self.amounts
+
+    def todict(self):
+        return {'ts': self.keys.tolist(), 'amount': self.amounts.tolist()}
+
+def tojson(obj):                                          # json.dumps() default for history data
+    if isinstance(obj, Series):
+        return obj.todict()
+    raise TypeError("Object of type %s is not JSON serializable" % type(obj).__name__)
+
+class Accumulator:
+    """Running totals of one historydata section ('rain' or 'lightning').
+
+    The section keeps the layout of history.json. The 1h, 24h and all-time
+    totals are cached and updated on insert and on expiry instead of being
+    re-summed for every measurement. Only the last years years are kept
+    in 'yearly' (0: all), earlier ones are rolled up into 'older', so the
+    history stays the same size over the years of operation.
+
+    Samples older than the last expire() (e.g. an MQTT backlog with source
+    timestamps) are late: they only count for the periods and buckets they
+    belong to, not for the running hour / day / week / month. A sample of a
+    later hour than the last expire() or after its deadline() (a backlog
+    replayed by source time) expires everything due at its own time first,
+    so the values do not depend on when housekeeping runs.
+    """
+
+    PERIODS = (('hourly', "%Y%m%d%H"), ('daily', "%Y%m%d"), ('weekly', "%Y%W"), ('monthly', "%Y%m"))
+
+    def __init__(self, history, integer=False, years=0):
+        self.history = history
+        self.integer = integer                            # Lightning counts instead of rain amounts
+        self.years = int(years)
+        self.clock = None                                 # ts of the last expire()
+        self.clockhour = None                             # Start of its local hour
+        self.year = None                                  # Year of the last roll-up
+        history.setdefault('older', 0)
+        # In-memory representation of the 1h / 24h series
+        for (key, span) in (('1h', 3600), ('24h', 86400)):
+            if not isinstance(history[key], Series):
+                history[key] = Series(span, history[key], 'q' if integer else 'd')
+        if history['yearly']:
+            self.rollup(max(int(year) for year in history['yearly']))
+        self.recalc()
+
+    def recalc(self):
+        h = self.history
+        self.total1h = 0
+        for amount in h['1h'].values():
+            self.total1h = self.sum(self.total1h, amount)
+        self.total24h = 0
+        for amount in h['24h'].values():
+            self.total24h = self.sum(self.total24h, amount)
+        self.alltime = self.value(h['older'])
+        for year in h['yearly']:
+            self.alltime = self.sum(self.alltime, h['yearly'][year])
+
+    def rollup(self, year):
+        """Fold the years before the last self.years into 'older'."""
+        h = self.history
+        self.year = year
+        if not self.years:
+            return
+        for key in sorted(h['yearly']):
+            if int(key) > year - self.years:
+                break
+            h['older'] = self.sum(h['older'], h['yearly'].pop(key))
+
+    def sum(self, a, b):
+        if self.integer:
+            return int(a) + b
+        return round(float(a) + float(b),3)
+
+    def value(self, v):
+        if self.integer:
+            return int(v)
+        return round(float(v),3)
+
+    def total(self, v):
+        if self.integer:
+            return int(round(float(v),1))
+        return round(float(v),3)
+
+    def add(self, ts, amount, event=False):
+        h = self.history
+        # Bucket keys: start of the local minute / hour as epoch
+        t = int(ts)
+        lt = time.localtime(t)
+        thisminute = t - (t + lt.tm_gmtoff) % 60
+        thishour = t - (t + lt.tm_gmtoff) % 3600
+        thisyear = "%04d" % lt.tm_year
+        last = t
+        late = self.clock is not None and t < self.clock
+        if not late and (self.clock is None or thishour > self.clockhour or ts > self.deadline()):
+            self.expire(datetime.datetime.fromtimestamp(ts))
+        if event and not late: # Calculate Rain Event, https://www.wetterstationsforum.info/viewtopic.php?t=241
+            h['event']['amount'] = self.sum(h['event']['amount'], amount)
+            h['event']['last'] = last
+        elif event and t + 86400 >= self.clock: # Late sample within a still running event
+            h['event']['amount'] = self.sum(h['event']['amount'], amount)
+        for (period, key) in self.PERIODS:
+            if not late:
+                h[period]['amount'] = self.sum(h[period]['amount'], amount)
+                h[period]['last'] = last
+            elif time.strftime(key, lt) == time.strftime(key, time.localtime(self.clock)):
+                h[period]['amount'] = self.sum(h[period]['amount'], amount)
+        if self.years and self.year is not None and lt.tm_year <= self.year - self.years:
+            h['older'] = self.sum(h['older'], amount) # Late sample of a rolled up year
+        else:
+            h['yearly'][thisyear] = self.sum(h['yearly'].get(thisyear, 0), amount)
+        if late:
+            thisyear = "%04d" % time.localtime(self.clock).tm_year
+        self.alltime = self.sum(self.alltime, amount)
+        ret = dict()
+        ret['2'] = self.value(h['event']['amount'])
+        ret['3'] = self.total(self.total1h)
+        ret['4'] = self.value(h['daily']['amount'])
+        ret['5'] = self.value(h['weekly']['amount'])
+        ret['6'] = self.value(h['monthly']['amount'])
+        ret['7'] = self.value(h['yearly'].get(thisyear, 0))
+        ret['8'] = self.total(self.alltime)
+        # 24h: amount of the running hour
+        if not late or thishour == self.clockhour:
+            old = h['24h'].set(thishour, h['hourly']['amount'])
+            self.total24h = self.sum(self.total24h, float(h['hourly']['amount']) - float(old))
+        elif self.clock <= thishour + 86400: # Late sample of an earlier hour
+            old = h['24h'].set(thishour, 0)
+            h['24h'].set(thishour, self.sum(old, amount))
+            self.total24h = self.sum(self.total24h, amount)
+        ret['9'] = self.total(self.total24h)
+        # 1h: amount of this minute
+        if not late or self.clock <= thisminute + 3600:
+            old = h['1h'].set(thisminute, amount)
+            self.total1h = self.sum(self.total1h, float(amount) - float(old))
+        return ret
+
+    def expire(self, now):
+        h = self.history
+        ts = now.timestamp()
+        self.clock = int(ts)
+        self.clockhour = self.clock - (self.clock + time.localtime(self.clock).tm_gmtoff) % 3600
+        if ts > float(h['event']['last']) + 86400: # Event, https://www.wetterstationsforum.info/viewtopic.php?t=241
+            h['event']['amount'] = 0
+        y = datetime.datetime.fromtimestamp(float(h['hourly']['last']))
+        for (period, key) in self.PERIODS: # Hourly, daily, weekly, monthly
+            if now.strftime(key) != y.strftime(key):
+                h[period]['amount'] = 0
+        if now.year != self.year: # Yearly retention
+            self.rollup(now.year)
+        self.total24h = self.sum(self.total24h, -h['24h'].expire(ts)) # 24h
+        self.total1h = self.sum(self.total1h, -h['1h'].expire(ts)) # 1h
+
+    def deadline(self):
+        h = self.history
+        due = float('inf')
+        if float(h['event']['amount']) > 0: # Event
+            due = min(due, float(h['event']['last']) + 86400)
+        return min(due, h['24h'].deadline(), h['1h'].deadline())
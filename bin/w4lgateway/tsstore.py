@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+# Compact on-disk time series of the converted observations
+
+import os
+import time
+import shutil
+import logging
+
+import numpy as np
+
+log = logging.getLogger()
+
+RECORD = np.dtype([('ts', '<f8'), ('value', '<f4')])    # 12 bytes per observation
+
+def ftoc(f):                                              # Fahrenheit to Celsius
+    return (f - 32) * 5 / 9.0
+
+def mphtokmh(f):
+    return f * 1.609344
+
+def inhgtohpa(f):                                         # Inverse of hpatoin() of the sensors
+    return f * 33.87
+
+def intomm(f):
+    return f * 25.4
+
+def winddescription(degrees):
+    names = ("North", "Northeast", "East", "Southeast", "South", "Southwest", "West", "Northwest")
+    return names[int((degrees % 360) / 45.0 + 0.5) % 8]
+
+# Columns of hourlyhistory.dat filled from the gateway outputs. The output
+# names are configurable (NAMEn of the sensors), so columns refer to value n
+# of a sensor; the first configured candidate is used:
+# column -> ([(sensor, value n)], aggregation, conversion, decimals)
+HOURLY = {
+    11: ([('temp', '1')], 'mean', ftoc, 1),
+    12: ([('derived', '4')], 'mean', ftoc, 1),
+    13: ([('humidity', '1')], 'mean', None, 0),
+    15: ([('winddir', '1')], 'direction', None, 0),
+    16: ([('windspeed', '1')], 'mean', mphtokmh, 1),
+    17: ([('windspeed', '2')], 'max', mphtokmh, 1),
+    18: ([('derived', '3')], 'mean', ftoc, 1),
+    19: ([('pressure', '2')], 'mean', inhgtohpa, 0),
+    20: ([('derived', '1')], 'mean', ftoc, 1),
+    22: ([('solarradiation', '1'), ('illuminance', '2')], 'mean', None, 0),
+    23: ([('derived', '2')], 'mean', ftoc, 1),
+    24: ([('uv', '1')], 'mean', None, 0),
+    25: ([('rainrate', '4')], 'last', intomm, 1),
+    26: ([('rainrate', '3')], 'last', intomm, 1),
+}
+
+def hourlycolumns(sensors):
+    """Output names of the HOURLY columns in a sensor config: {column: name}."""
+    columns = dict()
+    for column in HOURLY:
+        for (item, n) in HOURLY[column][0]:
+            name = sensors.get(item, {}).get('name' + n)
+            if name:
+                columns[column] = name
+                break
+    return columns
+
+TEXTCOLUMNS = (5, 6, 7, 14, 27, 29, 32, 33)               # Empty instead of -9999
+COLUMNS = 38
+
+class TimeSeriesStore:
+    """Observations in day partitioned files of fixed width records.
+
+    Every output value is appended to <directory>/<YYYYMMDD>/<name>.dat as
+    (ts float64, value float32) at most once per resolution seconds. New
+    records are buffered and written every interval seconds. Files are read
+    with numpy.memmap, so a query only touches the days it needs. Once per
+    hour the store is rolled up into hourly rows in the layout of
+    data/hourlyhistory.format (pipe separated); mapcolumns() tells which
+    outputs fill its columns.
+    """
+
+    def __init__(self, directory, hourlyfile=None, interval=60, resolution=10, days=30, hours=48):
+        self.directory = directory
+        self.hourlyfile = hourlyfile
+        self.interval = float(interval)
+        self.resolution = float(resolution)
+        self.days = int(days)
+        self.hours = int(hours)
+        self.buffer = dict()                              # (day, name) -> [(ts, value)]
+        self.last = dict()                                # name -> ts of the last record
+        self.lastflush = time.time()
+        self.hour = None
+        self.day = None
+        self.partition = (0, 0, "")                       # (start, end, YYYYMMDD) of the current day
+        self.columns = dict()                             # column of hourlyhistory.dat -> output name
+
+    def mapcolumns(self, sensors, station="main"):
+        """Fill the hourly columns from the outputs of a sensor config."""
+        self.columns = hourlycolumns(sensors)
+        outputs = set()
+        for item in sensors:
+            for key in sensors[item]:
+                if key.startswith('name') and key[4:].isdigit() and sensors[item][key]:
+                    outputs.add(sensors[item][key])
+        unmapped = outputs - set(self.columns.values())
+        if unmapped:
+            log.info("Station %s: Outputs without a column in the hourly history: %s", station, ", ".join(sorted(unmapped)))
+
+    def dayof(self, ts):                                  # Partition of a timestamp
+        (start, end, day) = self.partition
+        if not start <= ts < end:
+            lt = time.localtime(ts)
+            start = time.mktime(lt[:3] + (0, 0, 0, 0, 0, -1))
+            end = time.mktime((lt.tm_year, lt.tm_mon, lt.tm_mday + 1, 0, 0, 0, 0, 0, -1))
+            day = time.strftime("%Y%m%d", lt)
+            self.partition = (start, end, day)
+        return day
+
+    def add(self, ts, values):
+        """Record the numeric values of a {name: value} dict."""
+        for name in values:
+            if ts < self.last.get(name, 0) + self.resolution:
+                continue
+            try:
+                value = float(values[name])
+            except (TypeError, ValueError):
+                continue
+            if value == -9999:
+                continue
+            self.last[name] = ts
+            self.buffer.setdefault((self.dayof(ts), name), []).append((ts, value))
+
+    def deadline(self):
+        if not self.buffer:
+            return float('inf')
+        return self.lastflush + self.interval
+
+    def flush(self):
+        for (day, name) in self.buffer:
+            path = os.path.join(self.directory, day)
+            try:
+                os.makedirs(path, exist_ok=True)
+                with open(os.path.join(path, name + ".dat"), 'ab') as f:
+                    f.write(np.array(self.buffer[(day, name)], dtype=RECORD).tobytes())
+            except OSError as e:
+                log.error("Cannot write time series %s: %s", name, e)
+        self.buffer = dict()
+        self.lastflush = time.time()
+
+    def housekeeping(self, now):
+        """Flush when due, roll up after every full hour, prune old days."""
+        if now >= self.deadline():
+            self.flush()
+        hour = int(now // 3600)
+        if hour != self.hour:
+            if self.hour is not None:
+                self.flush()
+            self.hour = hour
+            if self.hourlyfile:
+                self.writehourly(now)
+        day = time.strftime("%Y%m%d", time.localtime(now))
+        if day != self.day:
+            self.day = day
+            self.prune(now)
+
+    def read(self, name, start, end):
+        """Records of name with start <= ts < end (including unflushed ones)."""
+        parts = list()
+        day = time.mktime(time.localtime(start)[:3] + (0, 0, 0, 0, 0, -1))
+        while day < end:
+            lt = time.localtime(day)
+            file = os.path.join(self.directory, time.strftime("%Y%m%d", lt), name + ".dat")
+            count = os.path.getsize(file) // RECORD.itemsize if os.path.exists(file) else 0
+            if count:
+                records = np.memmap(file, dtype=RECORD, mode='r', shape=(count,))
+                i = np.searchsorted(records['ts'], start)
+                j = np.searchsorted(records['ts'], end)
+                parts.append(np.array(records[i:j]))
+            buffered = self.buffer.get((time.strftime("%Y%m%d", lt), name))
+            if buffered:
+                records = np.array(buffered, dtype=RECORD)
+                parts.append(records[(records['ts'] >= start) & (records['ts'] < end)])
+            day = time.mktime((lt.tm_year, lt.tm_mon, lt.tm_mday + 1, 0, 0, 0, 0, 0, -1))
+        if not parts:
+            return np.zeros(0, dtype=RECORD)
+        return np.concatenate(parts)
+
+    def hourly(self, start, end):
+        """Hourly rows (lists of strings) for the full hours between start and end."""
+        rows = list()
+        hour = start - start % 3600
+        columns = dict()
+        for column in self.columns:                       # One read per output name
+            columns[column] = self.read(self.columns[column], hour, end)
+        while hour + 3600 <= end:
+            lt = time.localtime(hour)
+            row = ["-9999"] * COLUMNS
+            for column in TEXTCOLUMNS:
+                row[column] = ""
+            row[0] = str(int(hour))
+            row[1] = time.strftime("%a, %d %b %Y %H:%M:%S %z", lt)
+            row[2] = time.strftime("%Z", lt)
+            row[3] = os.environ.get('TZ', "")
+            row[4] = time.strftime("%z", lt)
+            for column in self.columns:
+                (candidates, aggregation, conversion, decimals) = HOURLY[column]
+                records = columns[column]
+                values = records['value'][(records['ts'] >= hour) & (records['ts'] < hour + 3600)].astype(float)
+                if not len(values):
+                    continue
+                if aggregation == 'mean':
+                    value = values.mean()
+                elif aggregation == 'max':
+                    value = values.max()
+                elif aggregation == 'last':
+                    value = values[-1]
+                else: # Vector average of directions
+                    value = (np.degrees(np.arctan2(np.sin(np.radians(values)).sum(), np.cos(np.radians(values)).sum())) + 360) % 360
+                    row[14] = winddescription(value)
+                if conversion is not None:
+                    value = conversion(value)
+                row[column] = str(round(float(value), decimals)) if decimals else str(int(round(float(value))))
+            rows.append(row)
+            hour += 3600
+        return rows
+
+    def writehourly(self, now):
+        """Write the last hours to the hourlyhistory file (atomic replace)."""
+        end = now - now % 3600
+        rows = self.hourly(end - self.hours * 3600, end)
+        tmp = self.hourlyfile + ".tmp"
+        try:
+            with open(tmp, 'w') as f:
+                for row in rows:
+                    f.write("|".join(row) + "\n")
+            os.replace(tmp, self.hourlyfile)
+        except OSError as e:
+            log.error("Cannot write %s: %s", self.hourlyfile, e)
+
+    def prune(self, now):
+        """Delete day partitions older than days."""
+        oldest = time.strftime("%Y%m%d", time.localtime(now - self.days * 86400))
+        try:
+            entries = os.listdir(self.directory)
+        except OSError:
+            return
+        for entry in entries:
+            if entry.isdigit() and len(entry) == 8 and entry < oldest:
+                shutil.rmtree(os.path.join(self.directory, entry), ignore_errors=True)
+
+    def close(self):
+        self.flush()
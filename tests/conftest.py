@@ -0,0 +1,13 @@
+# -*- coding: utf-8 -*-
+# The gateway modules live in bin/ (w4lgateway package and the scripts)
+
+import os
+import sys
+import time
+
+BIN = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "bin")
+sys.path.insert(0, BIN)
+
+# Bucket keys and periods follow the local time, keep it reproducible
+os.environ['TZ'] = "Europe/Berlin"
+time.tzset()
@@ -0,0 +1,140 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+# Write replay.golden.jsonl: the output of the baseline gateway (commit
+# ec79b31) for replay.jsonl, one line per message like --write-golden of
+# w4l-replay.py. Run from a git checkout:
+#
+#   python3 baselinegolden.py > replay.golden.jsonl
+#
+# The message loop of the baseline w4l-gateway.py is taken from git and
+# executed statement by statement, with the readconfig() syntax fix,
+# datetime.now() replaced by the time of the message and the housekeeping
+# of the loop run before every message (the baseline ran it every 0.1 s).
+# The sensors are read from replay.cfg, which the baseline could not do.
+#
+# Columns a later request deliberately changed are taken from the current
+# code (w4l-replay.py --write-golden) instead:
+#   - wind gust and 2 / 10 minute wind speed and direction averages: time
+#     based windows of 120 / 600 s instead of 40 / 200 samples (user-003)
+#   - dew point, heat index, wind chill and feels-like: new (user-018)
+# All other differences between baseline and current code are listed on
+# stderr; there should be none.
+
+import os
+import ast
+import sys
+import json
+import math
+import time
+import types
+import queue
+import logging
+import datetime
+import tempfile
+import subprocess
+
+import numpy as np
+
+DATA = os.path.dirname(os.path.abspath(__file__))
+BIN = os.path.join(os.path.dirname(os.path.dirname(DATA)), "bin")
+BASELINE = "ec79b31"
+sys.path.insert(0, BIN)
+
+from w4lgateway import config
+
+os.environ['TZ'] = "Europe/Berlin"
+time.tzset()
+
+class Clock(datetime.datetime):                           # datetime.datetime with a fake now()
+    ts = 0.0
+
+    @classmethod
+    def now(cls, tz=None):
+        return cls.fromtimestamp(cls.ts, tz)
+
+class Values(dict):                                       # sensorvalues, remembers what a message set
+    def __setitem__(self, key, value):
+        self.changed[key] = value
+        super().__setitem__(key, value)
+
+def baseline():
+    """(process, housekeeping, functions) code objects of the baseline gateway."""
+    source = subprocess.check_output(["git", "show", BASELINE + ":bin/w4l-gateway.py"], cwd=DATA, universal_newlines=True)
+    source = source.replace("cfg.read(lbpconfigdir + '/weather4lox.cfg'))", "cfg.read(lbpconfigdir + '/weather4lox.cfg')")
+    tree = ast.parse(source)
+    functions = [node for node in tree.body if isinstance(node, ast.FunctionDef) and node.name in
+                 ('ctof', 'hpatoin', 'mstomph', 'intomm', 'mmtoin', 'avgwind', 'rainstats', 'lightningstats')]
+    loop = [node for node in tree.body if isinstance(node, ast.While)][-1].body
+    process = loop[0]                                     # while not q.empty(): ...
+    housekeeping = list()
+    for node in loop[1:]:
+        if 'lastsend' in ast.unparse(node):               # Ecowitt send and sleep: not part of the golden output
+            break
+        housekeeping.append(node)
+    def code(nodes):
+        return compile(ast.Module(body=nodes, type_ignores=[]), "baseline", "exec")
+    return (code([process]), code(housekeeping), code(functions))
+
+def baselineoutputs(records, sensors):
+    (process, housekeeping, functions) = baseline()
+    sensors = dict((item, dict(sensors[item])) for item in sensors if 'topic' in sensors[item])
+    if 'converttable' in sensors.get('winddir', {}):
+        table = sensors['winddir']['converttable']
+        sensors['winddir']['converttable'] = dict((str(round(float(volt),1)), float(deg)) for (volt, deg) in
+                                                 (pair.split(':', 1) for pair in table.split(',') if ':' in pair))
+    g = {'q': queue.Queue(), 'sensors': sensors, 'data': dict(), 'sensorvalues': Values(), 'historydata': dict(),
+         'windspeed_avg2m': list(), 'windspeed_avg10m': list(), 'winddir_avg2m': list(), 'winddir_avg10m': list(),
+         'log': logging.getLogger(), 'np': np, 'json': json, 'time': time,
+         'datetime': types.SimpleNamespace(datetime=Clock, timedelta=datetime.timedelta),
+         'sin': math.sin, 'cos': math.cos, 'radians': math.radians, 'degrees': math.degrees, 'atan2': math.atan2}
+    exec(functions, g)
+    # Empty history like readhistory() without a file
+    for kind in ('rain', 'lightning'):
+        for period in ('event', 'hourly', 'daily', 'weekly', 'monthly'):
+            g['historydata'].setdefault(kind, {})[period] = {'amount': 0, 'last': 0}
+        g['historydata'][kind].update({'yearly': {}, '24h': {}, '1h': {}})
+    g['historydata']['lightning']['offset'] = 0
+    outputs = list()
+    for (ts, topic, payload) in records:
+        Clock.ts = ts
+        exec(housekeeping, g)
+        g['sensorvalues'].changed = dict()
+        g['q'].put(types.SimpleNamespace(topic=topic, payload=payload))
+        exec(process, g)
+        outputs.append(g['sensorvalues'].changed)
+    return outputs
+
+def currentoutputs(recording, configfile):
+    with tempfile.TemporaryDirectory() as tmp:
+        golden = os.path.join(tmp, "golden.jsonl")
+        subprocess.check_call([sys.executable, "w4l-replay.py", "--replay=" + recording, "--config=" + configfile,
+                               "--write-golden=" + golden, "--tz=Europe/Berlin"], cwd=BIN, stdout=subprocess.DEVNULL)
+        with open(golden) as f:
+            return [json.loads(line) for line in f]
+
+def rebaselined(sensors):                                 # Output names of deliberately changed columns
+    columns = {'windspeed': ('2', '3', '4'), 'winddir': ('2', '3'), 'derived': ('1', '2', '3', '4')}
+    return set(sensors[item]['name' + n] for item in columns if item in sensors for n in columns[item] if 'name' + n in sensors[item])
+
+recording = os.path.join(DATA, "replay.jsonl")
+configfile = os.path.join(DATA, "replay.cfg")
+(cfg, pconfig, sensors) = config.readconfig(configfile)
+with open(recording) as f:
+    records = [json.loads(line) for line in f if line.strip()]
+records = [(entry['ts'], entry['topic'], entry['payload'].encode("utf-8")) for entry in records]
+
+old = baselineoutputs(records, sensors)
+new = currentoutputs(recording, configfile)
+columns = rebaselined(sensors)
+differences = dict()
+for (i, (a, b)) in enumerate(zip(old, new)):
+    values = dict((name, a[name]) for name in a if name not in columns)
+    values.update((name, b[name]) for name in b if name in columns)
+    for name in set(values) | set(b):
+        if name not in columns and values.get(name) != b.get(name):
+            differences.setdefault(name, []).append((i, values.get(name), b.get(name)))
+    sys.stdout.write(json.dumps(values, sort_keys=True) + "\n")
+for name in sorted(differences):
+    (i, a, b) = differences[name][0]
+    sys.stderr.write("%s: %d differences, first at message %d: baseline %r, current %r\n" % (name, len(differences[name]), i, a, b))
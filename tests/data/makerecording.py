@@ -0,0 +1,114 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+# Write replay.jsonl: a SYNTHETIC recording of a weather station (there is
+# no capture of a real station in the repository). Fixed seed, so the file
+# is reproducible: python3 makerecording.py > replay.jsonl
+#
+# 26 hours from Sunday 2025-10-12 06:00 to Monday 08:00 (Europe/Berlin):
+# midnight and a week boundary, no DST change. Temperature, humidity,
+# pressure and illuminance follow a daily cycle every 15 minutes, rain and
+# lightning report every 10 minutes (rainrate is mm per 10 minutes, the
+# lightning number is the counter of the sensor), wind every 15 minutes and
+# in bursts of 2 minutes at 3 second intervals every 4 hours. Deliberate
+# edge cases: a rain shower and drizzle (rain state ON, so CALC_RR takes
+# over), a heavy thunderstorm (a rain event) with a reboot of the lightning
+# sensor (counter back to 0), unknown wind direction voltages, an outage
+# of 40 minutes without any message and an unrelated topic below the base
+# topic.
+
+import sys
+import json
+import math
+import random
+import datetime
+
+SEED = 4711
+TOPIC = "weather4lox"
+TZ = datetime.timezone(datetime.timedelta(hours=2))      # CEST
+START = datetime.datetime(2025, 10, 12, 6, 0, tzinfo=TZ).timestamp()
+HOURS = 26
+OUTAGE = (START + 19 * 3600, START + 19 * 3600 + 2400)    # 01:00 - 01:40, nothing received
+DIRECTIONS = {0: "0.4", 90: "1.2", 180: "2.5", 270: "3.3"}
+
+rnd = random.Random(SEED)
+
+def hour(ts):                                             # Local hours since Sunday 00:00
+    return (ts - START) / 3600.0 + 6
+
+def temperature(ts):                                      # 7 C at 06:00, 17 C at 15:00
+    return 12 - 5 * math.cos((hour(ts) - 3) / 24 * 2 * math.pi) + rnd.gauss(0, 0.15)
+
+def humidity(ts):
+    return min(99, max(30, 95 - 4 * (temperature(ts) - 7) + rnd.gauss(0, 1.5)))
+
+def illuminance(ts):                                      # Sunrise 07:30, sunset 18:30
+    h = hour(ts) % 24
+    if h < 7.5 or h > 18.5:
+        return 0.0
+    return max(0.0, 45000 * math.sin((h - 7.5) / 11 * math.pi) * rnd.uniform(0.6, 1.0))
+
+def rain(ts):                                             # mm per 10 minutes and rain state
+    h = hour(ts)
+    if 14 <= h < 15.5:                                    # Shower
+        return (round(rnd.uniform(0.3, 1.2), 1), "ON")
+    if 15.5 <= h < 16.5:                                  # Drizzle below the resolution of the gauge
+        return (0.0, "ON")
+    if 21 <= h < 22:                                      # Thunderstorm, above the 0.5 in/h limit of CALC_RR
+        return (round(rnd.uniform(2.2, 4.0), 1), "ON")
+    return (0.0, "OFF")
+
+def wind(ts):                                             # m/s and direction, gusty in the afternoon
+    base = 2 + 3 * max(0, math.sin((hour(ts) - 9) / 24 * 2 * math.pi))
+    speed = max(0.0, rnd.gauss(base, 1.2))
+    direction = rnd.choice((180, 270, 270, 270, 0, 90) if hour(ts) < 20 else (270, 0, 0, 90))
+    return (round(speed, 1), direction)
+
+messages = list()
+
+def add(ts, topic, payload):
+    if not OUTAGE[0] <= ts < OUTAGE[1]:
+        messages.append((round(ts, 3), TOPIC + "/" + topic, payload))
+
+def addwind(ts):
+    (speed, direction) = wind(ts)
+    add(ts, "windspeed", "%.1f" % speed)
+    volt = DIRECTIONS[direction] if rnd.random() > 0.03 else "1.9" # Unknown voltage
+    add(ts + 0.2, "winddir", volt)
+
+pressure = 978.0                                          # Absolute, 300 m above sea level
+lightning = 143                                           # Counter since the last boot of the sensor
+rebooted = False
+rainstate = None
+ts = START
+while ts < START + HOURS * 3600:
+    if round(ts - START) % 900 == 0:
+        t = ts + rnd.uniform(0, 20)
+        pressure += rnd.gauss(-0.05 if hour(t) < 20 else 0.1, 0.1)
+        add(t, "temp", "%.1f" % temperature(t))
+        add(t + 0.5, "humidity", "%.1f" % humidity(t))
+        add(t + 1.0, "pressure", "%.1f" % pressure)
+        add(t + 1.5, "illuminance", "%.1f" % illuminance(t))
+        addwind(t + 2.0)
+    if round(ts - START) % 600 == 0:
+        t = ts + 30 + rnd.uniform(0, 5)
+        (amount, state) = rain(t)
+        if state != rainstate:
+            add(t - 1, "rainstate", state)
+            rainstate = state
+        add(t, "rainrate", "%.1f" % amount)
+        if 20.5 <= hour(t) < 22.5:
+            lightning += rnd.randint(0, 12)
+        if hour(t) >= 21.7 and not rebooted:              # Sensor reboot during the storm
+            lightning = rnd.randint(0, 3)
+            rebooted = True
+        add(t + 0.5, "lightning_number", str(lightning))
+    if round(ts - START) % 14400 == 7200:                 # Burst: one message every 3 seconds for 2 minutes
+        for i in range(40):
+            addwind(ts + 60 + i * 3)
+    if round(ts - START) % 3600 == 1800:
+        add(ts + 5, "status", "online")                   # Not a sensor topic
+    ts += 300
+
+for (ts, topic, payload) in sorted(messages):
+    sys.stdout.write(json.dumps({'ts': ts, 'topic': topic, 'payload': payload}) + "\n")
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+# Derived quantities of w4lgateway.derived
+
+import numpy as np
+
+from w4lgateway.derived import heatindex, windchill, feelslike, derive
+
+def test_heatindex_is_temperature_when_not_hot():
+    assert heatindex(20.0, 50) == 20.0
+    assert heatindex(70.0, 90) == 70.0
+    assert heatindex(79.0, 10) == 79.0                     # Averaged simple formula below 80 F
+
+def test_heatindex_when_hot():
+    # NWS table: 90 F at 60 % -> 100 F
+    assert round(heatindex(90.0, 60)) == 100
+
+def test_heatindex_arrays():
+    t = np.array([20.0, 70.0, 90.0])
+    hi = heatindex(t, np.array([50, 90, 60]))
+    assert list(hi[:2]) == [20.0, 70.0]
+    assert round(hi[2]) == 100
+    assert list(feelslike(t, 50, 0)[:2]) == [20.0, 70.0]
+
+def test_derive_feelslike():
+    rnd = np.random.default_rng(3)
+    t = rnd.uniform(-20, 110, 500)
+    rh = rnd.uniform(5, 100, 500)
+    v = rnd.uniform(0, 40, 500)
+    assert np.array_equal(derive(t, rh, v)['4'], feelslike(t, rh, v))
+    assert np.array_equal(derive(t, rh)['4'], feelslike(t, rh, 0))
+    assert np.array_equal(derive(t, windspeedmph=v)['4'], np.where(t <= 50, windchill(t, v), t))
+    for i in range(500):
+        assert derive(t[i], rh[i], v[i])['4'] == feelslike(t[i], rh[i], v[i])
+    assert derive(95.0)['4'] == 95.0                      # Neither humidity nor wind
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+# history.json of w4lgateway.persist
+
+import json
+import datetime
+
+from w4lgateway.persist import HistoryStore, LAYOUT
+from w4lgateway.station import Station
+
+NOW = datetime.datetime(2026, 7, 1, 12, 30).timestamp()
+HOUR = int(NOW // 3600 * 3600)
+MINUTE = int(NOW // 60 * 60)
+
+def period(amount, last):
+    return {'amount': amount, 'last': last}
+
+def layout1():                                            # history.json as written before layout 2
+    section = dict((p, period(0.1, str(NOW - 60))) for p in ('event', 'hourly', 'daily', 'weekly', 'monthly'))
+    rain = dict(section, yearly={'2025': 10.0, '2026': 2.5},
+                **{'24h': {str(float(HOUR - 3600)): 0.2, str(float(HOUR)): 0.1},
+                   '1h': {str(float(MINUTE - 60)): 0.05, str(float(MINUTE)): 0.05}})
+    lightning = dict(section, yearly={'2026': 3}, offset=7, **{'24h': {str(float(HOUR)): 3.0}, '1h': {}})
+    return {'rain': rain, 'lightning': lightning}
+
+def load(filename):
+    s = Station(config={'historyyears': 10})
+    s.loadhistory(HistoryStore(filename, journal=False))
+    return s
+
+def totals(s):
+    return (s.rainstats.total1h, s.rainstats.total24h, s.rainstats.alltime,
+            s.lightningstats.total24h, s.lightningstats.alltime)
+
+def test_layout1_round_trip(tmp_path):
+    filename = str(tmp_path / "history.json")
+    with open(filename, 'w') as f:
+        json.dump(layout1(), f, indent=2)
+    first = load(filename)
+    assert totals(first) == (0.1, 0.3, 12.5, 3, 3)
+    assert first.store.dirty                              # Converted at the next checkpoint
+    first.close()
+    with open(filename) as f:
+        saved = json.load(f)
+    assert saved['layout'] == LAYOUT
+    assert saved['rain']['24h'] == {'ts': [HOUR - 3600, HOUR], 'amount': [0.2, 0.1]}
+    assert saved['lightning']['24h'] == {'ts': [HOUR], 'amount': [3]}
+    second = load(filename)
+    assert totals(second) == totals(first)
+    assert second.historydata['lightning']['offset'] == 7
+    assert not second.store.dirty
+
+def test_zero_increments_are_not_journaled(tmp_path):
+    filename = str(tmp_path / "history.json")
+    s = Station()
+    s.loadhistory(HistoryStore(filename))
+    for i in range(10):
+        ret = s.addhistory('rain', NOW + i * 60, 0)
+        s.addhistory('lightning', NOW + i * 60, 0)
+    assert ret['9'] == 0
+    assert not s.store.dirty
+    assert not (tmp_path / "history.journal").exists()
+    s.addhistory('rain', NOW + 600, 0.04)
+    assert s.store.dirty
+    with open(str(tmp_path / "history.journal")) as f:
+        assert len(f.readlines()) == 1
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+# Replay of a synthetic station recording against the baseline output
+#
+# tests/data/replay.jsonl is generated by makerecording.py (no real capture),
+# replay.golden.jsonl by baselinegolden.py from the baseline gateway, with
+# only the columns later requests deliberately changed taken from the
+# current code (see there).
+
+import os
+import sys
+import subprocess
+
+import pytest
+
+from conftest import BIN
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+def replay(*args):
+    return subprocess.run([sys.executable, "w4l-replay.py", "--replay=" + os.path.join(DATA, "replay.jsonl"),
+                           "--config=" + os.path.join(DATA, "replay.cfg"), "--tz=Europe/Berlin"] + list(args),
+                          cwd=BIN, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+
+# The golden file is written per message. With --batch the current values
+# after every batch must be the same as after its last message.
+@pytest.mark.parametrize("batch", [1, 10, 50])
+def test_golden(batch):
+    result = replay("--golden=" + os.path.join(DATA, "replay.golden.jsonl"), "--batch=%d" % batch)
+    assert result.returncode == 0, result.stdout
+    assert "Golden check passed." in result.stdout
+
+def test_golden_is_written_per_message(tmp_path):
+    result = replay("--write-golden=" + str(tmp_path / "golden.jsonl"), "--batch=10")
+    assert result.returncode == 2
+    assert not (tmp_path / "golden.jsonl").exists()
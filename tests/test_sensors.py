@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Payload helpers of w4lgateway.sensors
+
+import pytest
+
+from w4lgateway.sensors import jsonpath, jsonvalue, parsetime
+
+def test_jsonpath():
+    assert jsonpath("$.Wind.0.Speed") == ('Wind', 0, 'Speed')
+    assert jsonvalue({'Wind': [{'Speed': 3}]}, jsonpath("Wind.0.Speed")) == 3
+
+def test_parsetime():
+    assert parsetime(b"1760000000") == 1760000000.0
+    assert parsetime(1760000000123) == 1760000000.123
+    assert parsetime("2025-10-09T08:53:20Z") == 1760000000.0
+
+@pytest.mark.parametrize("value", ["nan", "inf", "-inf", b"NaN", float('nan')])
+def test_parsetime_rejects_non_finite(value):
+    with pytest.raises(ValueError):
+        parsetime(value)
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+# EcowittSink against a local HTTP server
+
+import time
+import threading
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from w4lgateway.sinks import EcowittSink
+
+TIMEOUT = 0.2                                             # Read timeout of the sink
+
+class Handler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        server.requests.append((time.time(), urllib.parse.parse_qs(body.decode("utf-8"))))
+        behaviour = server.behaviour.pop(0) if server.behaviour else 200
+        if behaviour == 'slow':
+            time.sleep(TIMEOUT * 3)
+            behaviour = 200
+        self.send_response(behaviour)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b"OK")
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    server.requests = list()
+    server.behaviour = list()                             # Per request: status code or 'slow'
+    server.url = "http://127.0.0.1:%d/data/report/" % server.server_port
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def sink(server, **kwargs):
+    s = EcowittSink(server.url, 0, readtimeout=TIMEOUT, **kwargs)
+    s.start()
+    return s
+
+def wait(condition, timeout=5):
+    end = time.time() + timeout
+    while not condition():
+        assert time.time() < end, "timed out"
+        time.sleep(0.01)
+
+def test_send(server):
+    s = sink(server)
+    s.submit({'tempf': 68.5, 'humidity': 60})
+    wait(lambda: s.stats['sent'] == 1)
+    s.stop()
+    (ts, data) = server.requests[0]
+    assert data['tempf'] == ['68.5'] and data['humidity'] == ['60'] and 'dateutc' in data
+    assert (s.stats['errors'], s.stats['retries'], s.stats['failed']) == (0, 0, 0)
+    assert 0 < s.stats['latency'] < TIMEOUT
+    assert s.stats['latency_sum'] == s.stats['latency_max'] == s.stats['latency']
+    assert s.latency.count == 1 and s.latency.sum == s.stats['latency']
+
+def test_timeout_is_retried_with_backoff(server):
+    server.behaviour = ['slow', 'slow']
+    s = sink(server, retries=5, backoff=0.1)
+    s.submit({'tempf': 68.5})
+    wait(lambda: s.stats['sent'] == 1)
+    s.stop()
+    assert len(server.requests) == 3
+    assert (s.stats['errors'], s.stats['retries'], s.stats['failed']) == (2, 2, 0)
+    # Read timeout plus 0.1 / 0.2 s backoff between the attempts
+    times = [ts for (ts, data) in server.requests]
+    assert times[1] - times[0] >= TIMEOUT + 0.1
+    assert times[2] - times[1] >= TIMEOUT + 0.2
+    assert s.latency.count == 1                           # Only successful sends
+    assert s.stats['latency'] < TIMEOUT
+
+def test_give_up_after_max_attempts(server):
+    server.behaviour = ['slow', 500, 500, 200]
+    s = sink(server, retries=2, backoff=0.05)
+    s.submit({'tempf': 68.5})
+    wait(lambda: s.stats['failed'] == 1)
+    time.sleep(0.2)                                       # No further attempt
+    s.stop()
+    assert len(server.requests) == 3 and s.pending is None
+    assert (s.stats['sent'], s.stats['errors'], s.stats['retries'], s.stats['failed']) == (0, 3, 2, 1)
+    assert s.latency.count == 0 and s.stats['latency_sum'] == 0.0
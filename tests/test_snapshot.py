@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+# Memory mapped snapshot of w4lgateway.snapshot
+
+import pytest
+
+from w4lgateway.snapshot import SnapshotFile, SnapshotReader, HEADERSIZE
+
+def test_update_and_read(tmp_path):
+    path = str(tmp_path / "w4l.snapshot")
+    writer = SnapshotFile(path, slots=4)
+    writer.update(1000.0, {'tempf': 68.0, 'humidity': 55})
+    writer.update(1010.0, {'tempf': 69.5, 'winddir': "N"})
+    (updated, values) = SnapshotReader(path).read()
+    assert updated == 1010.0
+    assert values['tempf'] == (69.5, 1010.0)
+    assert values['humidity'] == (55.0, 1000.0)
+    assert values['winddir'][0] != values['winddir'][0]   # NaN
+    writer.close()
+
+def test_torn_payload_is_not_used(tmp_path):
+    # Counter unchanged but payload without its CRC, as seen out of order on ARM
+    path = str(tmp_path / "w4l.snapshot")
+    writer = SnapshotFile(path, slots=4)
+    writer.update(1000.0, {'tempf': 68.0})
+    writer.map[HEADERSIZE + 50] ^= 0xff
+    with pytest.raises(TimeoutError):
+        SnapshotReader(path).read(retries=3)
+    writer.close()
+
+def test_rebuild_drops_removed_outputs(tmp_path):
+    path = str(tmp_path / "w4l.snapshot")
+    writer = SnapshotFile(path, slots=3)
+    writer.update(1000.0, {'a': 1, 'b': 2, 'c': 3})
+    writer.rebuild({'c': 3, 'a': 1})
+    (updated, values) = SnapshotReader(path).read()
+    assert values == {'a': (1.0, 1000.0), 'c': (3.0, 1000.0)}
+    writer.update(1010.0, {'d': 4})                      # Slot of b is free again
+    assert SnapshotReader(path).read()[1]['d'] == (4.0, 1010.0)
+    writer.close()
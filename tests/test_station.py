@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+# Message processing of w4lgateway.station
+
+from w4lgateway.station import Station
+
+SENSORS = {
+    'temp': {'topic': "tele/SENSOR", 'json': "$.BME280.Temperature", 'name1': "tempf"},
+    'humidity': {'topic': "tele/SENSOR", 'json': "BME280.Humidity", 'name1': "humidity"},
+}
+
+def station():
+    s = Station()
+    s.configure(SENSORS, "weather4lox")
+    s.loadhistory()
+    return s
+
+def test_json_payload_feeds_several_sensors():
+    ret = station().process("weather4lox/tele/SENSOR", b'{"BME280": {"Temperature": 20, "Humidity": 55}}', 1000.0)
+    assert ret['tempf'] == 68.0
+    assert ret['humidity'] == 55.0
+
+def test_decoded_document_is_not_decoded_again():
+    # The gateway decodes the payload for the source time and passes the document on
+    document = {'BME280': {'Temperature': 25, 'Humidity': 40}}
+    ret = station().process("weather4lox/tele/SENSOR", b'not parsed', 1000.0, document)
+    assert ret['tempf'] == 77.0
+    assert ret['humidity'] == 40.0
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+# Rain / lightning statistics of w4lgateway.stats
+
+import datetime
+
+from w4lgateway.station import Station
+
+MM = 0.04                                                  # About 1 mm in inches
+
+def station():
+    s = Station()
+    s.loadhistory()
+    return s
+
+def test_backlog_rolls_periods_over():
+    # 3 hours of rain caught up by source time after an outage
+    s = station()
+    start = datetime.datetime(2026, 7, 1, 10, 0).timestamp()
+    s.housekeeping(datetime.datetime.fromtimestamp(start - 7200))
+    for i in range(18):
+        ret = s.addhistory('rain', start + i * 600, MM, True)
+    h = s.historydata['rain']
+    assert list(h['24h'].values()) == [round(6 * MM, 3)] * 3
+    assert h['hourly']['amount'] == round(6 * MM, 3)
+    assert ret['9'] == round(18 * MM, 3)
+    assert ret['4'] == round(18 * MM, 3)
+
+def test_backlog_without_housekeeping():
+    s = station()
+    start = datetime.datetime(2026, 7, 1, 23, 0).timestamp()
+    for i in range(12):
+        ret = s.addhistory('rain', start + i * 600, MM)
+    assert list(s.historydata['rain']['24h'].values()) == [round(6 * MM, 3)] * 2
+    assert ret['4'] == round(6 * MM, 3)                    # New day
+    assert ret['9'] == round(12 * MM, 3)
+
+def test_late_sample_of_earlier_hour():
+    s = station()
+    now = datetime.datetime(2026, 7, 1, 12, 30)
+    s.addhistory('rain', now.timestamp(), MM)
+    s.housekeeping(now)
+    ret = s.addhistory('rain', now.timestamp() - 3600, MM)
+    assert ret['9'] == round(2 * MM, 3)
+    assert s.historydata['rain']['hourly']['amount'] == MM
+
+def test_backlog_expires_at_deadline():
+    # Same result as housekeeping at the time of the sample
+    start = datetime.datetime(2026, 7, 1, 10, 15).timestamp()
+    results = list()
+    for housekeeping in (False, True):
+        s = station()
+        for ts in (start, start + 3000, start + 3600.5):
+            if housekeeping:
+                s.housekeeping(datetime.datetime.fromtimestamp(ts))
+            s.addhistory('rain', ts, MM)
+        results.append(s.rainstats.total1h)
+    assert results == [round(2 * MM, 3)] * 2
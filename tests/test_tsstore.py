@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+# Time series store and hourly roll-up of w4lgateway.tsstore
+
+import logging
+import datetime
+
+from w4lgateway.tsstore import TimeSeriesStore, hourlycolumns
+
+SENSORS = {
+    'temp': {'topic': "temp", 'name1': "outdoor_temp"},
+    'windspeed': {'topic': "wind", 'name1': "wind", 'name2': "gust", 'name3': "wind2m"},
+    'illuminance': {'topic': "lux", 'name1': "lux", 'name2': "sr", 'calc_sr': "1"},
+}
+
+def test_columns_follow_the_sensor_config():
+    assert hourlycolumns(SENSORS) == {11: "outdoor_temp", 16: "wind", 17: "gust", 22: "sr"}
+
+def test_hourly_rows_of_renamed_outputs(tmp_path, caplog):
+    store = TimeSeriesStore(str(tmp_path), resolution=0)
+    with caplog.at_level(logging.INFO):
+        store.mapcolumns(SENSORS)
+    assert "lux, wind2m" in caplog.text                    # Outputs without a column are logged
+    hour = datetime.datetime(2026, 7, 1, 10, 0).timestamp()
+    for i in range(6):
+        store.add(hour + i * 600, {'outdoor_temp': 68.0 + i * 0.36, 'gust': 10.0 + i, 'lux': 1000})
+    (row,) = store.hourly(hour, hour + 3600)
+    assert row[0] == str(int(hour))
+    assert row[11] == "20.5"                               # Mean in Celsius
+    assert row[17] == str(round(15 * 1.609344, 1))         # Max in km/h
+    assert row[16] == "-9999"